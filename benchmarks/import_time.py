@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the ftl_pytest_agent package and its CLI entry points.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, so nothing is shared between runs. The
+cumulative time of the module is reported together with the heaviest imports it pulled in.
+
+With --check it exits with an error when an entry point is over its budget or imports one of the heavy
+dependencies, which should only be loaded once a command actually runs.
+
+    python benchmarks/import_time.py [--repeat N] [--top N] [--check] [module ...]
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+# Budget in milliseconds of the cumulative import time of each entry point
+BUDGETS = {
+    "ftl_pytest_agent": 50,
+    "ftl_pytest_agent.cli": 100,
+    "ftl_pytest_agent.cli2": 100,
+    "ftl_pytest_agent.ui": 100,
+}
+MODULES = list(BUDGETS)
+
+HEAVY_MODULES = ["smolagents", "litellm", "gradio", "numpy", "pandas", "rich", "jinja2"]
+
+
+def import_times(module):
+    """Runs `import module` under -X importtime and returns {imported module: (self us, cumulative us)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run(module, repeat, top):
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    heaviest = sorted(
+        ((name, cumulative) for name, (_, cumulative) in best.items() if "." not in name and name != module),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    print(f"{module:<24} {best[module][1] / 1000:>8.1f} ms  {len(best):>5} modules")
+    for name, cumulative in heaviest:
+        print(f"    {name:<20} {cumulative / 1000:>8.1f} ms")
+    return best
+
+
+def check(module, times):
+    """Returns the budget violations of an entry point."""
+    errors = []
+    budget = BUDGETS.get(module)
+    if budget is not None and times[module][1] / 1000 > budget:
+        errors.append(f"{module} takes {times[module][1] / 1000:.1f} ms to import, budget is {budget} ms")
+    heavy = [name for name in HEAVY_MODULES if name in times]
+    if heavy:
+        errors.append(f"{module} imports {', '.join(heavy)}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Number of heaviest top-level imports to list")
+    parser.add_argument("--check", action="store_true", help="Fail if an entry point is over its budget")
+    args = parser.parse_args()
+    errors = []
+    for module in args.modules:
+        try:
+            times = run(module, args.repeat, args.top)
+        except RuntimeError as e:
+            print(f"{module:<24} import failed: {e}")
+            errors.append(f"{module} failed to import")
+            continue
+        if args.check:
+            errors.extend(check(module, times))
+    if args.check and errors:
+        print()
+        for error in errors:
+            print(f"FAIL: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
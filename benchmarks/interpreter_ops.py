@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for the AST interpreter in local_python_executor.
+
+Runs a few loop-heavy snippets, like the ones generated tests contain, through LocalPythonInterpreter and
+reports how many AST nodes per second it evaluates.
+
+    python benchmarks/interpreter_ops.py [--repeat N]
+"""
+
+import argparse
+import time
+
+from ftl_pytest_agent.local_python_executor import LocalPythonInterpreter
+
+
+SNIPPETS = {
+    "arithmetic_loop": """
+total = 0
+for i in range(20000):
+    if i % 3 == 0:
+        total += i * 2
+    else:
+        total -= 1
+assert total != 0
+""",
+    "while_loop": """
+n = 0
+values = []
+while n < 10000:
+    values.append(n ** 2 % 7)
+    n += 1
+""",
+    "comprehension": """
+squares = [x * x for x in range(20000) if x % 2 == 0]
+lookup = {x: str(x) for x in range(5000)}
+""",
+    "function_calls": """
+def helper(a, b=2):
+    return a * b + 1
+
+results = [helper(i) for i in range(5000)]
+""",
+    "helper_in_comprehension": """
+data = {f"key_{i}": i for i in range(200)}
+def check(value, limit=100):
+    doubled = value * 2
+    return doubled > limit
+
+flags = [check(i) for i in range(10000)]
+""",
+}
+
+
+def run(name, code, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        interpreter = LocalPythonInterpreter([], {})
+        start = time.perf_counter()
+        interpreter(code, {})
+        best = min(best, time.perf_counter() - start)
+    ops = interpreter.operations_count
+    print(f"{name:<18} {ops:>10,d} ops  {best * 1000:>9.1f} ms  {ops / best:>12,.0f} ops/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for name, code in SNIPPETS.items():
+        run(name, code, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,7 @@ from smolagents.agent_types import (
     handle_agent_output_types,
 )
 from smolagents.memory import MemoryStep
+from ftl_pytest_agent.agents import ModelStreamDelta
 from ftl_pytest_agent.memory import ActionStep
 
 
@@ -161,6 +162,8 @@ def pull_messages_from_step(
             print("input_token_count")
             token_str = f" | Input-tokens:{step_log.input_token_count:,} | Output-tokens:{step_log.output_token_count:,}"
             step_footnote += token_str
+        if getattr(step_log, "context_tokens", None):
+            step_footnote += f" | Context-tokens: ~{step_log.context_tokens:,}"
         if hasattr(step_log, "duration"):
             print("duration")
             step_duration = (
@@ -181,19 +184,36 @@ def stream_to_gradio(
     reset_agent_memory: bool = False,
     additional_args: Optional[dict] = None,
 ):
-    """Runs an agent with the given task and streams the messages from the agent as gradio ChatMessages."""
+    """
+    Runs an agent with the given task and streams the messages from the agent as gradio ChatMessages.
+
+    `context.python` and `context.explain` are the `TestFileWriter`s of the generated test and explanation, they are
+    flushed after every step.
+    """
 
     total_input_tokens = 0
     total_output_tokens = 0
 
+    live_output = ""
     for step_log in agent.run(
         task, stream=True, reset=reset_agent_memory, additional_args=additional_args
     ):
+        if isinstance(step_log, ModelStreamDelta):
+            live_output += step_log.content
+            yield gr.ChatMessage(
+                role="assistant",
+                content=live_output,
+                metadata={"title": f"Step {step_log.step_number}", "status": "pending"},
+            )
+            continue
+        live_output = ""
         if isinstance(step_log, ActionStep):
             generate_explain_action_step(context.explain, step_log)
             if step_log.tool_calls:
                 for call in step_log.tool_calls:
                     generate_python_tool_call(context.python, call)
+            context.python.flush()
+            context.explain.flush()
         # Track tokens if model provides them
         if hasattr(agent.model, "last_input_token_count"):
             total_input_tokens += agent.model.last_input_token_count
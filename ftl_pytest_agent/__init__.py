@@ -1,14 +1,32 @@
 from contextlib import contextmanager
-
-from smolagents.tools import Tool
-from .tools import load_tools, get_tool, load_code
-from .default_tools import TOOLS
 from dataclasses import dataclass
-from ftl_pytest_agent.local_python_executor import FinalAnswerException
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from smolagents.tools import Tool
+
+
+# The tool helpers pull in smolagents, so they are only imported when used (PEP 562)
+_LAZY_ATTRIBUTES = {
+    "Tool": "smolagents.tools",
+    "load_tools": "ftl_pytest_agent.tools",
+    "get_tool": "ftl_pytest_agent.tools",
+    "load_code": "ftl_pytest_agent.tools",
+    "TOOLS": "ftl_pytest_agent.default_tools",
+    "FinalAnswerException": "ftl_pytest_agent.local_python_executor",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Tools(object):
-    def __init__(self, tools: dict[str, Tool]):
+    def __init__(self, tools: "dict[str, Tool]"):
         self.__dict__.update(tools)
 
 
@@ -19,6 +37,10 @@ class FTL:
 
 @contextmanager
 def fixtures(tools_files, code_files, tools, **kwargs):
+    from .tools import load_tools, get_tool, load_code
+    from .default_tools import TOOLS
+    from .local_python_executor import FinalAnswerException
+
     tool_classes = {}
     tool_classes.update(TOOLS)
     state = {
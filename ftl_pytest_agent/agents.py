@@ -17,6 +17,8 @@
 
 # from smolagents.agents with changes to add tool tracing
 
+import asyncio
+import copy
 import importlib
 import inspect
 import json
@@ -24,11 +26,15 @@ import os
 import re
 import tempfile
 import textwrap
+import threading
 import time
-from collections import deque
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
 from logging import getLogger
 from pathlib import Path
-from typing import Any, Callable, Dict, Generator, List, Optional, Set, Tuple, TypedDict, Union
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, List, Optional, Set, Tuple, TypedDict, Union
 
 import jinja2
 import yaml
@@ -44,11 +50,13 @@ from smolagents.default_tools import TOOL_MAPPING, FinalAnswerTool
 from smolagents.e2b_executor import E2BExecutor
 from ftl_pytest_agent.local_python_executor import (
     BASE_BUILTIN_MODULES,
+    DEFAULT_MAX_TRACE_ENTRIES,
     LocalPythonInterpreter,
     fix_final_answer_code,
 )
-from smolagents.memory import AgentMemory, PlanningStep, SystemPromptStep, TaskStep, ToolCall
-from ftl_pytest_agent.memory import ActionStep
+from ftl_pytest_agent.budget import ContextBudget
+from ftl_pytest_agent.memory import ActionStep, AgentMemory, MessageView, PlanningStep, SystemPromptStep, TaskStep, ToolCall
+from ftl_pytest_agent.models import StopSequenceDetector, acall_model
 from smolagents.models import (
     ChatMessage,
     MessageRole,
@@ -82,14 +90,74 @@ def get_variable_names(self, template: str) -> Set[str]:
     return {match.group(1).strip() for match in pattern.finditer(template)}
 
 
+@lru_cache(maxsize=None)
+def _load_prompt_templates(package: str, resource: str) -> "PromptTemplates":
+    return yaml.safe_load(importlib.resources.files(package).joinpath(resource).read_text())
+
+
+def load_prompt_templates(package: str, resource: str) -> "PromptTemplates":
+    """
+    Loads the prompt templates from a YAML file shipped in `package`.
+
+    The file is read and parsed once per process, every caller gets its own copy of the templates.
+    """
+    return copy.deepcopy(_load_prompt_templates(package, resource))
+
+
+@lru_cache(maxsize=128)
+def compile_template(template: str) -> Template:
+    return Template(template, undefined=StrictUndefined)
+
+
 def populate_template(template: str, variables: Dict[str, Any]) -> str:
-    compiled_template = Template(template, undefined=StrictUndefined)
+    compiled_template = compile_template(template)
     try:
         return compiled_template.render(**variables)
     except Exception as e:
         raise Exception(f"Error during jinja template rendering: {type(e).__name__}: {e}")
 
 
+SYSTEM_PROMPT_CACHE_SIZE = 64
+
+_system_prompts = OrderedDict()
+_system_prompts_lock = threading.Lock()
+
+
+def _system_prompt_key(template: str, tools: Dict[str, Tool], managed_agents: Dict, variables: Dict[str, Any]):
+    # Only what the system prompt templates render of the tools and managed agents
+    return (
+        template,
+        tuple(
+            (name, tool.name, tool.description, repr(tool.inputs), tool.output_type) for name, tool in tools.items()
+        ),
+        tuple((name, agent.name, agent.description) for name, agent in managed_agents.items()),
+        tuple(sorted(variables.items())),
+    )
+
+
+def populate_system_prompt(template: str, tools: Dict[str, Tool], managed_agents: Dict, **variables) -> str:
+    """
+    Renders a system prompt template, memoized by the template and the tool set.
+
+    Agents with the same tools and managed agents share the rendered prompt, so building many agents or running
+    one agent many times renders it once. Extra `variables` must be hashable.
+    """
+    key = _system_prompt_key(template, tools, managed_agents, variables)
+    with _system_prompts_lock:
+        system_prompt = _system_prompts.get(key)
+        if system_prompt is not None:
+            _system_prompts.move_to_end(key)
+            return system_prompt
+    system_prompt = populate_template(
+        template, variables={"tools": tools, "managed_agents": managed_agents, **variables}
+    )
+    with _system_prompts_lock:
+        _system_prompts[key] = system_prompt
+        if len(_system_prompts) > SYSTEM_PROMPT_CACHE_SIZE:
+            _system_prompts.popitem(last=False)
+    return system_prompt
+
+
 class PlanningPromptTemplate(TypedDict):
     """
     Prompt templates for the planning step.
@@ -190,8 +258,12 @@ class MultiStepAgent:
         description (`str`, *optional*): Necessary for a managed agent only - the description of this agent.
         provide_run_summary (`bool`, *optional*): Whether to provide a run summary when called as a managed agent.
         final_answer_checks (`list`, *optional*): List of Callables to run before returning a final answer for checking validity.
+        context_budget ([`~budget.ContextBudget`], *optional*): Keeps the messages sent to the model under a token budget.
     """
 
+    # Set by agents that yield the model output while it is generated, see `_stream_step`
+    stream_outputs = False
+
     def __init__(
         self,
         tools: List[Tool],
@@ -209,6 +281,7 @@ class MultiStepAgent:
         description: Optional[str] = None,
         provide_run_summary: bool = False,
         final_answer_checks: Optional[List[Callable]] = None,
+        context_budget: Optional[ContextBudget] = None,
     ):
         if tool_parser is None:
             tool_parser = parse_json_tool_call
@@ -224,6 +297,7 @@ class MultiStepAgent:
         self.name = name
         self.description = description
         self.provide_run_summary = provide_run_summary
+        self.context_budget = context_budget
 
         self.managed_agents = {}
         if managed_agents is not None:
@@ -276,16 +350,18 @@ class MultiStepAgent:
     def write_memory_to_messages(
         self,
         summary_mode: Optional[bool] = False,
-    ) -> List[Dict[str, str]]:
+    ) -> MessageView:
         """
         Reads past llm_outputs, actions, and observations or errors from the memory into a series of messages
         that can be used as input to the LLM. Adds a number of keywords (such as PLAN, error, etc) to help
         the LLM.
+
+        Each memory step is rendered once and appended to a shared message log, the returned view is read-only.
+        If the agent has a context budget, the messages are fitted to it.
         """
-        messages = self.memory.system_prompt.to_messages(summary_mode=summary_mode)
-        for memory_step in self.memory.steps:
-            messages.extend(memory_step.to_messages(summary_mode=summary_mode))
-        return messages
+        if self.context_budget is not None and not summary_mode:
+            return self.context_budget.fit(self.memory)
+        return self.memory.write_to_messages(summary_mode=bool(summary_mode))
 
     def visualize(self):
         """Creates a rich tree visualization of the agent's structure."""
@@ -407,6 +483,10 @@ class MultiStepAgent:
         """To be implemented in children classes. Should return either None if the step is not final."""
         pass
 
+    async def astep(self, memory_step: ActionStep) -> Union[None, Any]:
+        """Awaitable version of `step`. Children classes that can await their model call should override this."""
+        return await asyncio.to_thread(self.step, memory_step)
+
     def run(
         self,
         task: str,
@@ -432,7 +512,48 @@ class MultiStepAgent:
         agent.run("What is the result of 2 power 3.7384?")
         ```
         """
+        self._setup_run(task, reset=reset, images=images, additional_args=additional_args)
+
+        if stream:
+            # The steps are returned as they are executed through a generator to iterate on.
+            return self._run(task=self.task, images=images)
+        # Outputs are returned only at the end as a string. We only look at the last step
+        return deque(self._run(task=self.task, images=images), maxlen=1)[0]
+
+    def arun(
+        self,
+        task: str,
+        reset: bool = True,
+        images: Optional[List[str]] = None,
+        additional_args: Optional[Dict] = None,
+    ) -> AsyncGenerator[ActionStep | AgentType, None]:
+        """
+        Run the agent for the given task on the running event loop.
 
+        This is the asyncio counterpart of `run(task, stream=True)`: it returns an async generator yielding the same
+        `ActionStep` objects followed by the final answer, but the model calls are awaited so that many agents can
+        share one event loop.
+
+        Args:
+            task (`str`): Task to perform.
+            reset (`bool`): Whether to reset the conversation or keep it going from previous run.
+            images (`list[str]`, *optional*): Paths to image(s).
+            additional_args (`dict`): Any other variables that you want to pass to the agent run.
+
+        Model outputs are not streamed: an agent created with `stream_outputs` raises a `ValueError`.
+        """
+        if self.stream_outputs:
+            raise ValueError("stream_outputs is only supported by run(stream=True), not by arun")
+        self._setup_run(task, reset=reset, images=images, additional_args=additional_args)
+        return self._arun(task=self.task, images=images)
+
+    def _setup_run(
+        self,
+        task: str,
+        reset: bool = True,
+        images: Optional[List[str]] = None,
+        additional_args: Optional[Dict] = None,
+    ):
         self.task = task
         if additional_args is not None:
             self.state.update(additional_args)
@@ -455,12 +576,6 @@ You have been provided with these additional arguments, that you can access usin
 
         self.memory.steps.append(TaskStep(task=self.task, task_images=images))
 
-        if stream:
-            # The steps are returned as they are executed through a generator to iterate on.
-            return self._run(task=self.task, images=images)
-        # Outputs are returned only at the end as a string. We only look at the last step
-        return deque(self._run(task=self.task, images=images), maxlen=1)[0]
-
     def _run(self, task: str, images: List[str] | None = None) -> Generator[ActionStep | AgentType, None, None]:
         """
         Run the agent in streaming mode and returns a generator of all the steps.
@@ -488,49 +603,102 @@ You have been provided with these additional arguments, that you can access usin
                 self.logger.log_rule(f"Step {self.step_number}", level=LogLevel.INFO)
 
                 # Run one step!
-                final_answer = self.step(memory_step)
-                if final_answer is not None and self.final_answer_checks is not None:
-                    for check_function in self.final_answer_checks:
-                        try:
-                            assert check_function(final_answer, self.memory)
-                        except Exception as e:
-                            final_answer = None
-                            raise AgentError(f"Check {check_function.__name__} failed with error: {e}", self.logger)
+                if self.stream_outputs:
+                    step_output = yield from self._stream_step(memory_step)
+                else:
+                    step_output = self.step(memory_step)
+                final_answer = self._check_final_answer(step_output)
             except AgentError as e:
                 memory_step.error = e
             finally:
-                memory_step.end_time = time.time()
-                memory_step.duration = memory_step.end_time - step_start_time
-                self.memory.steps.append(memory_step)
-                for callback in self.step_callbacks:
-                    # For compatibility with old callbacks that don't take the agent as an argument
-                    if len(inspect.signature(callback).parameters) == 1:
-                        callback(memory_step)
-                    else:
-                        callback(memory_step, agent=self)
-                self.step_number += 1
+                self._finalize_step(memory_step)
                 yield memory_step
 
         if final_answer is None and self.step_number == self.max_steps + 1:
-            error_message = "Reached max steps."
             final_answer = self.provide_final_answer(task, images)
-            final_memory_step = ActionStep(
-                step_number=self.step_number, error=AgentMaxStepsError(error_message, self.logger)
+            final_memory_step = self._max_steps_step(final_answer, memory_step, step_start_time)
+            yield final_memory_step
+
+        yield handle_agent_output_types(final_answer)
+
+    async def _arun(self, task: str, images: List[str] | None = None) -> AsyncGenerator[ActionStep | AgentType, None]:
+        """
+        Run the agent on the event loop and returns an async generator of all the steps.
+
+        Args:
+            task (`str`): Task to perform.
+            images (`list[str]`): Paths to image(s).
+        """
+        final_answer = None
+        self.step_number = 1
+        while final_answer is None and self.step_number <= self.max_steps:
+            step_start_time = time.time()
+            memory_step = ActionStep(
+                step_number=self.step_number,
+                start_time=step_start_time,
+                observations_images=images,
             )
-            final_memory_step.action_output = final_answer
-            final_memory_step.end_time = time.time()
-            final_memory_step.duration = memory_step.end_time - step_start_time
-            self.memory.steps.append(final_memory_step)
-            for callback in self.step_callbacks:
-                # For compatibility with old callbacks that don't take the agent as an argument
-                if len(inspect.signature(callback).parameters) == 1:
-                    callback(final_memory_step)
-                else:
-                    callback(final_memory_step, agent=self)
+            try:
+                if self.planning_interval is not None and self.step_number % self.planning_interval == 1:
+                    await asyncio.to_thread(
+                        self.planning_step,
+                        task,
+                        is_first_step=(self.step_number == 1),
+                        step=self.step_number,
+                    )
+                self.logger.log_rule(f"Step {self.step_number}", level=LogLevel.INFO)
+
+                # Run one step!
+                final_answer = self._check_final_answer(await self.astep(memory_step))
+            except AgentError as e:
+                memory_step.error = e
+            finally:
+                self._finalize_step(memory_step)
+            yield memory_step
+
+        if final_answer is None and self.step_number == self.max_steps + 1:
+            final_answer = await asyncio.to_thread(self.provide_final_answer, task, images)
+            final_memory_step = self._max_steps_step(final_answer, memory_step, step_start_time)
             yield final_memory_step
 
         yield handle_agent_output_types(final_answer)
 
+    def _check_final_answer(self, final_answer: Any) -> Any:
+        if final_answer is not None and self.final_answer_checks is not None:
+            for check_function in self.final_answer_checks:
+                try:
+                    assert check_function(final_answer, self.memory)
+                except Exception as e:
+                    raise AgentError(f"Check {check_function.__name__} failed with error: {e}", self.logger)
+        return final_answer
+
+    def _finalize_step(self, memory_step: ActionStep):
+        memory_step.end_time = time.time()
+        memory_step.duration = memory_step.end_time - memory_step.start_time
+        self.memory.steps.append(memory_step)
+        self._run_step_callbacks(memory_step)
+        self.step_number += 1
+
+    def _max_steps_step(self, final_answer: Any, memory_step: ActionStep, step_start_time: float) -> ActionStep:
+        error_message = "Reached max steps."
+        final_memory_step = ActionStep(
+            step_number=self.step_number, error=AgentMaxStepsError(error_message, self.logger)
+        )
+        final_memory_step.action_output = final_answer
+        final_memory_step.end_time = time.time()
+        final_memory_step.duration = memory_step.end_time - step_start_time
+        self.memory.steps.append(final_memory_step)
+        self._run_step_callbacks(final_memory_step)
+        return final_memory_step
+
+    def _run_step_callbacks(self, memory_step: ActionStep):
+        for callback in self.step_callbacks:
+            # For compatibility with old callbacks that don't take the agent as an argument
+            if len(inspect.signature(callback).parameters) == 1:
+                callback(memory_step)
+            else:
+                callback(memory_step, agent=self)
+
     def planning_step(self, task, is_first_step: bool, step: int) -> None:
         """
         Used periodically by the agent to plan the next steps to reach the objective.
@@ -1049,9 +1217,7 @@ class ToolCallingAgent(MultiStepAgent):
         planning_interval: Optional[int] = None,
         **kwargs,
     ):
-        prompt_templates = prompt_templates or yaml.safe_load(
-            importlib.resources.files("smolagents.prompts").joinpath("toolcalling_agent.yaml").read_text()
-        )
+        prompt_templates = prompt_templates or load_prompt_templates("smolagents.prompts", "toolcalling_agent.yaml")
         super().__init__(
             tools=tools,
             model=model,
@@ -1061,9 +1227,8 @@ class ToolCallingAgent(MultiStepAgent):
         )
 
     def initialize_system_prompt(self) -> str:
-        system_prompt = populate_template(
-            self.prompt_templates["system_prompt"],
-            variables={"tools": self.tools, "managed_agents": self.managed_agents},
+        system_prompt = populate_system_prompt(
+            self.prompt_templates["system_prompt"], self.tools, self.managed_agents
         )
         return system_prompt
 
@@ -1077,11 +1242,13 @@ class ToolCallingAgent(MultiStepAgent):
         self.input_messages = memory_messages
 
         # Add new step in logs
-        memory_step.model_input_messages = memory_messages.copy()
+        memory_step.model_input_messages = memory_messages
+        if self.context_budget is not None:
+            memory_step.context_tokens = self.context_budget.last_total
 
         try:
             model_message: ChatMessage = self.model(
-                memory_messages,
+                list(memory_messages),
                 tools_to_call_from=list(self.tools.values()),
                 stop_sequences=["Observation:"],
             )
@@ -1151,6 +1318,26 @@ class ToolCallingAgent(MultiStepAgent):
             return None
 
 
+@dataclass
+class ModelStreamDelta:
+    """Text generated by the model for the step `step_number`, yielded by `run(stream=True)` as it arrives."""
+
+    step_number: int
+    content: str
+
+
+@dataclass
+class CandidateTrial:
+    """A model completion dry-run by `CodeAgent` in a fork of its interpreter."""
+
+    future: Any
+    step: ActionStep
+    executor: Any = None
+    output: Any = None
+    is_final_answer: bool = False
+    error: Optional[AgentError] = None
+
+
 class CodeAgent(MultiStepAgent):
     """
     In this agent, the tool calls will be formulated by the LLM in code format, then parsed and executed.
@@ -1164,6 +1351,18 @@ class CodeAgent(MultiStepAgent):
         planning_interval (`int`, *optional*): Interval at which the agent will run a planning step.
         use_e2b_executor (`bool`, default `False`): Whether to use the E2B executor for remote code execution.
         max_print_outputs_length (`int`, *optional*): Maximum length of the print outputs.
+        trace_filter (`str` or `list[str]`, default `"all"`): Calls recorded in the step trace: "all", "tools" or a
+            list of function names.
+        max_trace_entries (`int`, *optional*): Maximum number of calls recorded per step.
+        max_trace_repr_length (`int`, *optional*): If set, traced arguments are stored as reprs of at most this length.
+        num_candidates (`int`, default `1`): Number of completions requested from the model at each step. Each one is
+            dry-run in a fork of the interpreter and the first that reaches the final answer is kept, otherwise the
+            first that runs without error.
+        stream_outputs (`bool`, default `False`): Read the completion from `model.stream` and yield it as
+            `ModelStreamDelta`s from `run(stream=True)`, for display. The completion ends at the first stop sequence
+            and its code runs once it is complete. `arun` does not support it.
+        python_executor (`Callable`, *optional*): Executor for the code actions, called like `LocalPythonInterpreter`,
+            for instance an interpreter of an `InterpreterPool`. It must already provide the tools of the agent.
         **kwargs: Additional keyword arguments.
 
     """
@@ -1178,15 +1377,20 @@ class CodeAgent(MultiStepAgent):
         planning_interval: Optional[int] = None,
         use_e2b_executor: bool = False,
         max_print_outputs_length: Optional[int] = None,
+        trace_filter: Union[str, List[str]] = "all",
+        max_trace_entries: int = DEFAULT_MAX_TRACE_ENTRIES,
+        max_trace_repr_length: Optional[int] = None,
+        num_candidates: int = 1,
+        stream_outputs: bool = False,
+        python_executor: Optional[Callable] = None,
         **kwargs,
     ):
         self.additional_authorized_imports = additional_authorized_imports if additional_authorized_imports else []
-        self.authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
+        # Sorted so the rendered system prompt, and the response cache keys, are the same in every process
+        self.authorized_imports = sorted(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
         self.use_e2b_executor = use_e2b_executor
         self.max_print_outputs_length = max_print_outputs_length
-        prompt_templates = prompt_templates or yaml.safe_load(
-            importlib.resources.files("smolagents.prompts").joinpath("code_agent.yaml").read_text()
-        )
+        prompt_templates = prompt_templates or load_prompt_templates("smolagents.prompts", "code_agent.yaml")
         super().__init__(
             tools=tools,
             model=model,
@@ -1207,7 +1411,9 @@ class CodeAgent(MultiStepAgent):
             )
 
         all_tools = {**self.tools, **self.managed_agents}
-        if use_e2b_executor:
+        if python_executor is not None:
+            self.python_executor = python_executor
+        elif use_e2b_executor:
             self.python_executor = E2BExecutor(
                 self.additional_authorized_imports,
                 list(all_tools.values()),
@@ -1218,20 +1424,32 @@ class CodeAgent(MultiStepAgent):
                 self.additional_authorized_imports,
                 all_tools,
                 max_print_outputs_length=max_print_outputs_length,
+                trace_filter=trace_filter,
+                max_trace_entries=max_trace_entries,
+                max_trace_repr_length=max_trace_repr_length,
             )
+        if num_candidates > 1 and not hasattr(self.python_executor, "fork"):
+            raise ValueError(
+                "num_candidates > 1 needs an executor that can be forked, like LocalPythonInterpreter, "
+                f"not {type(self.python_executor).__name__}"
+            )
+        self.num_candidates = num_candidates
+        if stream_outputs and not hasattr(self.model, "stream"):
+            raise ValueError("stream_outputs needs a model with a `stream` method")
+        if stream_outputs and num_candidates > 1:
+            raise ValueError("stream_outputs cannot be combined with num_candidates > 1")
+        self.stream_outputs = stream_outputs
 
     def initialize_system_prompt(self) -> str:
-        system_prompt = populate_template(
+        system_prompt = populate_system_prompt(
             self.prompt_templates["system_prompt"],
-            variables={
-                "tools": self.tools,
-                "managed_agents": self.managed_agents,
-                "authorized_imports": (
-                    "You can import from any package you want."
-                    if "*" in self.authorized_imports
-                    else str(self.authorized_imports)
-                ),
-            },
+            self.tools,
+            self.managed_agents,
+            authorized_imports=(
+                "You can import from any package you want."
+                if "*" in self.authorized_imports
+                else str(self.authorized_imports)
+            ),
         )
         return system_prompt
 
@@ -1240,24 +1458,140 @@ class CodeAgent(MultiStepAgent):
         Perform one step in the ReAct framework: the agent thinks, acts, and observes the result.
         Returns None if the step is not final.
         """
-        memory_messages = self.write_memory_to_messages()
+        model_kwargs = self._prepare_step(memory_step)
+        if self.num_candidates > 1:
+            return self._step_candidates(memory_step, model_kwargs)
+        try:
+            chat_message: ChatMessage = self.model(list(self.input_messages), **model_kwargs)
+        except Exception as e:
+            raise AgentGenerationError(f"Error in generating model output:\n{e}", self.logger) from e
+        return self._execute_step(memory_step, chat_message)
 
-        self.input_messages = memory_messages.copy()
+    async def astep(self, memory_step: ActionStep) -> Union[None, Any]:
+        """
+        Same as `step`, but the model call is awaited instead of blocking the event loop.
+        """
+        model_kwargs = self._prepare_step(memory_step)
+        if self.num_candidates > 1:
+            return await self._astep_candidates(memory_step, model_kwargs)
+        try:
+            chat_message: ChatMessage = await acall_model(self.model, list(self.input_messages), **model_kwargs)
+        except Exception as e:
+            raise AgentGenerationError(f"Error in generating model output:\n{e}", self.logger) from e
+        return self._execute_step(memory_step, chat_message)
 
-        # Add new step in logs
-        memory_step.model_input_messages = memory_messages.copy()
+    def _stream_step(self, memory_step: ActionStep) -> Generator[ModelStreamDelta, None, Union[None, Any]]:
+        """
+        Same as `step`, but yields the model output as it is generated and returns the output of the step.
+
+        The model stream is closed at the first stop sequence, so a model that keeps writing past `<end_code>` does not
+        delay the execution. The output is then parsed like a whole completion.
+        """
+        model_kwargs = self._prepare_step(memory_step)
+        end = StopSequenceDetector(model_kwargs.get("stop_sequences"))
+        chunks = self.model.stream(list(self.input_messages), **model_kwargs)
         try:
-            additional_args = {"grammar": self.grammar} if self.grammar is not None else {}
-            chat_message: ChatMessage = self.model(
-                self.input_messages,
-                stop_sequences=["<end_code>", "Observation:"],
-                **additional_args,
-            )
-            memory_step.model_output_message = chat_message
-            model_output = chat_message.content
-            memory_step.model_output = model_output
+            for delta in chunks:
+                yield ModelStreamDelta(memory_step.step_number, delta)
+                if end.feed(delta):
+                    break
         except Exception as e:
             raise AgentGenerationError(f"Error in generating model output:\n{e}", self.logger) from e
+        finally:
+            chunks.close()
+        chat_message = ChatMessage(role=MessageRole.ASSISTANT, content=end.text)
+        return self._execute_step(memory_step, chat_message)
+
+    def _step_candidates(self, memory_step: ActionStep, model_kwargs: Dict[str, Any]) -> Union[None, Any]:
+        messages = list(self.input_messages)
+        trials = []
+        pool = ThreadPoolExecutor(max_workers=self.num_candidates)
+        try:
+            futures = [pool.submit(self.model, messages, **model_kwargs) for _ in range(self.num_candidates)]
+            # Candidates are tried as they arrive, so a good early one does not wait for the slowest call
+            for future in as_completed(futures):
+                trials.append(self._try_candidate(memory_step, future))
+                if trials[-1].is_final_answer:
+                    break
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self._commit_candidate(memory_step, trials)
+
+    async def _astep_candidates(self, memory_step: ActionStep, model_kwargs: Dict[str, Any]) -> Union[None, Any]:
+        messages = list(self.input_messages)
+        pending = {
+            asyncio.ensure_future(acall_model(self.model, messages, **model_kwargs)) for _ in range(self.num_candidates)
+        }
+        trials = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    trials.append(self._try_candidate(memory_step, task))
+                    if trials[-1].is_final_answer:
+                        return self._commit_candidate(memory_step, trials)
+        finally:
+            for task in pending:
+                task.cancel()
+        return self._commit_candidate(memory_step, trials)
+
+    def _try_candidate(self, memory_step: ActionStep, future) -> "CandidateTrial":
+        """Dry-runs the completion of `future` in a fork of the interpreter."""
+        trial = CandidateTrial(
+            future=future,
+            step=ActionStep(step_number=memory_step.step_number, start_time=memory_step.start_time),
+        )
+        try:
+            chat_message = future.result()
+        except Exception as e:
+            trial.error = AgentGenerationError(f"Error in generating model output:\n{e}", self.logger)
+            return trial
+        trial.step.model_input_messages = memory_step.model_input_messages
+        trial.step.context_tokens = memory_step.context_tokens
+        trial.executor = self.python_executor.fork()
+        try:
+            trial.output, trial.is_final_answer = self._run_code_action(trial.step, chat_message, trial.executor)
+        except AgentError as e:
+            trial.error = e
+        return trial
+
+    def _commit_candidate(self, memory_step: ActionStep, trials: List["CandidateTrial"]) -> Union[None, Any]:
+        chosen = next((trial for trial in trials if trial.is_final_answer), None)
+        if chosen is None:
+            chosen = next((trial for trial in trials if trial.error is None), trials[0])
+        self.logger.log(
+            f"Kept candidate {trials.index(chosen) + 1} of {len(trials)} tried",
+            level=LogLevel.DEBUG,
+        )
+        for field in ("model_output_message", "model_output", "tool_calls", "trace", "observations", "action_output"):
+            setattr(memory_step, field, getattr(chosen.step, field))
+        if chosen.executor is not None:
+            self.python_executor.commit(chosen.executor)
+        if chosen.error is not None:
+            raise chosen.error
+        return chosen.output if chosen.is_final_answer else None
+
+    def _prepare_step(self, memory_step: ActionStep) -> Dict[str, Any]:
+        memory_messages = self.write_memory_to_messages()
+
+        # The view shares the message log with the previous steps instead of copying the conversation
+        self.input_messages = memory_messages
+        memory_step.model_input_messages = memory_messages
+        if self.context_budget is not None:
+            memory_step.context_tokens = self.context_budget.last_total
+
+        additional_args = {"grammar": self.grammar} if self.grammar is not None else {}
+        return dict(stop_sequences=["<end_code>", "Observation:"], **additional_args)
+
+    def _execute_step(self, memory_step: ActionStep, chat_message: ChatMessage) -> Union[None, Any]:
+        output, is_final_answer = self._run_code_action(memory_step, chat_message, self.python_executor)
+        return output if is_final_answer else None
+
+    def _run_code_action(self, memory_step: ActionStep, chat_message: ChatMessage, python_executor) -> Tuple[Any, bool]:
+        """Parses the code in `chat_message` and runs it with `python_executor`, returns (output, is_final_answer)."""
+        memory_step.model_output_message = chat_message
+        model_output = chat_message.content
+        memory_step.model_output = model_output
 
         self.logger.log_markdown(
             content=model_output,
@@ -1284,7 +1618,7 @@ class CodeAgent(MultiStepAgent):
         self.logger.log_code(title="Executing parsed code:", content=code_action, level=LogLevel.INFO)
         is_final_answer = False
         try:
-            output, execution_logs, is_final_answer, trace = self.python_executor(
+            output, execution_logs, is_final_answer, trace = python_executor(
                 code_action,
                 self.state,
             )
@@ -1297,8 +1631,8 @@ class CodeAgent(MultiStepAgent):
                 ]
             observation = "Execution logs:\n" + execution_logs
         except Exception as e:
-            if hasattr(self.python_executor, "state") and "_print_outputs" in self.python_executor.state:
-                execution_logs = str(self.python_executor.state["_print_outputs"])
+            if hasattr(python_executor, "state") and "_print_outputs" in python_executor.state:
+                execution_logs = str(python_executor.state["_print_outputs"])
                 if len(execution_logs) > 0:
                     execution_outputs_console = [
                         Text("Execution logs:", style="bold"),
@@ -1326,4 +1660,4 @@ class CodeAgent(MultiStepAgent):
         ]
         self.logger.log(Group(*execution_outputs_console), level=LogLevel.INFO)
         memory_step.action_output = output
-        return output if is_final_answer else None
+        return output, is_final_answer
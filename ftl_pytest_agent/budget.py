@@ -0,0 +1,180 @@
+from logging import getLogger
+from typing import Callable, Dict, List, Tuple, Union
+
+from smolagents.models import MessageRole
+
+from ftl_pytest_agent.memory import AgentMemory, Message, MessageLog, MessageView, TaskStep
+
+
+logger = getLogger(__name__)
+
+# Rough average for the tokenizers of the local models we run, good enough to stay under num_ctx
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+TRUNCATED_OBSERVATION = "\n..._This observation has been truncated to fit the context window_..."
+
+
+def text_length(message: Message) -> int:
+    content = message["content"]
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+
+
+def estimate_tokens(message: Message) -> int:
+    return text_length(message) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_message(message: Message, length: int) -> Message:
+    """Copy of `message` keeping the first `length` characters of its text, followed by a truncation note."""
+    content = message["content"]
+    if isinstance(content, str):
+        return Message(role=message["role"], content=content[:length] + TRUNCATED_OBSERVATION)
+    parts = []
+    for part in content:
+        if isinstance(part, dict) and "text" in part:
+            part = {**part, "text": part["text"][:length]}
+            length -= len(part["text"])
+        parts.append(part)
+    parts.append({"type": "text", "text": TRUNCATED_OBSERVATION})
+    return Message(role=message["role"], content=parts)
+
+
+def drop_observations(memory: AgentMemory, log: MessageLog, keep_last_steps: int) -> List[Message]:
+    """Keeps every step but removes the tool responses of all but the last `keep_last_steps` steps."""
+    messages = log.system_messages()
+    first_kept = len(log.steps) - keep_last_steps
+    for index, step in enumerate(log.steps):
+        step_messages = log.step_messages(index)
+        if index < first_kept and not isinstance(step, TaskStep):
+            step_messages = [m for m in step_messages if m["role"] != MessageRole.TOOL_RESPONSE]
+        messages.extend(step_messages)
+    return messages
+
+
+def summarize(memory: AgentMemory, log: MessageLog, keep_last_steps: int) -> List[Message]:
+    """Renders all but the last `keep_last_steps` steps with the `summary_mode` of the step types."""
+    summary_log = memory.message_log(summary_mode=True)
+    messages = log.system_messages()
+    first_kept = len(log.steps) - keep_last_steps
+    for index in range(len(log.steps)):
+        if index < first_kept:
+            messages.extend(summary_log.step_messages(index))
+        else:
+            messages.extend(log.step_messages(index))
+    return messages
+
+
+def last_steps(memory: AgentMemory, log: MessageLog, keep_last_steps: int) -> List[Message]:
+    """Keeps the system prompt, the tasks and only the last `keep_last_steps` steps."""
+    messages = log.system_messages()
+    first_kept = len(log.steps) - keep_last_steps
+    for index, step in enumerate(log.steps):
+        if index >= first_kept or isinstance(step, TaskStep):
+            messages.extend(log.step_messages(index))
+    return messages
+
+
+POLICIES: Dict[str, Callable[[AgentMemory, MessageLog, int], List[Message]]] = {
+    "drop_observations": drop_observations,
+    "summarize": summarize,
+    "last_steps": last_steps,
+}
+
+
+class ContextBudget:
+    """
+    Keeps the messages sent to the model under a token budget.
+
+    While the whole memory fits, the shared message log is used as is. Once it does not, the policy is applied to
+    the older steps, keeping fewer and fewer recent steps intact until the prompt fits again. If it does not fit with
+    the policy applied to every step, the longest observations are truncated.
+
+    Args:
+        max_tokens (`int`): Budget for the prompt, in estimated tokens.
+        policy (`str` or `Callable`): One of "drop_observations", "summarize" or "last_steps", or a callable taking
+            `(memory, log, keep_last_steps)` and returning the list of messages.
+        keep_last_steps (`int`): Number of recent steps that the policy leaves untouched at first.
+        counter (`Callable`): Estimates the tokens of one message.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        policy: Union[str, Callable] = "summarize",
+        keep_last_steps: int = 4,
+        counter: Callable[[Message], int] = estimate_tokens,
+    ):
+        if isinstance(policy, str):
+            if policy not in POLICIES:
+                raise ValueError(f"Unknown context policy {policy}, should be one of {list(POLICIES)}")
+            policy = POLICIES[policy]
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.keep_last_steps = keep_last_steps
+        self.counter = counter
+        self.last_total = 0
+
+    @classmethod
+    def for_context(cls, context: int, reserve: int = 1024, **kwargs) -> "ContextBudget":
+        """Budget for a model with a `context` window, leaving `reserve` tokens for the completion."""
+        return cls(max_tokens=context - reserve, **kwargs)
+
+    def count(self, messages) -> int:
+        return sum(self.counter(message) for message in messages)
+
+    def step_tokens(self, memory: AgentMemory) -> List[int]:
+        """Estimated tokens of each memory step as rendered in the prompt, counted once per step."""
+        log = memory.message_log()
+        for index in range(len(log.token_counts), len(log.steps)):
+            log.token_counts.append(self.count(log.step_messages(index)))
+        return log.token_counts
+
+    def fit(self, memory: AgentMemory) -> Union[MessageView, List[Message]]:
+        log = memory.message_log()
+        system_tokens = self.count(log.system_messages())
+        total = system_tokens + sum(self.step_tokens(memory))
+        if total <= self.max_tokens:
+            self.last_total = total
+            return log.view()
+
+        for keep in range(min(self.keep_last_steps, len(log.steps)), -1, -1):
+            messages = self.policy(memory, log, keep)
+            total = self.count(messages)
+            if total <= self.max_tokens:
+                break
+        else:
+            messages, total = self.truncate_observations(messages, total)
+            if total > self.max_tokens:
+                logger.warning(
+                    f"Prompt of {total} estimated tokens does not fit the budget of {self.max_tokens} tokens"
+                )
+        self.last_total = total
+        return messages
+
+    def truncate_observations(self, messages: List[Message], total: int) -> Tuple[List[Message], int]:
+        """Shortens the tool responses, the longest first, until the prompt fits. Returns the messages and the total."""
+        messages = list(messages)
+        observations = [index for index, message in enumerate(messages) if message["role"] == MessageRole.TOOL_RESPONSE]
+        observations.sort(key=lambda index: text_length(messages[index]), reverse=True)
+        for index in observations:
+            if total <= self.max_tokens:
+                break
+            message = messages[index]
+            others = total - self.counter(message)
+            # Longest text that fits, the counter may be any function of the text
+            low, high = 0, text_length(message)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if others + self.counter(truncate_message(message, middle)) <= self.max_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            messages[index] = truncate_message(message, low)
+            total = others + self.counter(messages[index])
+        return messages, total
+
+
+__all__ = ["ContextBudget", "estimate_tokens"]
@@ -1,17 +1,6 @@
-import click
+import os
 
-from .core import create_model, run_agent
-from .default_tools import TOOLS
-from .tools import get_tool, load_tools, load_code
-from .codegen import (
-    generate_python_header,
-    reformat_python,
-    generate_python_tool_call,
-    generate_explain_header,
-    generate_explain_action_step,
-)
-from ftl_pytest_agent.memory import ActionStep
-from smolagents.agent_types import AgentText
+import click
 
 
 @click.command()
@@ -34,6 +23,20 @@ def main(
     llm_api_base,
 ):
     """A agent that solves a problem given a system design and a set of tools"""
+    # Imported here so --help does not load smolagents and litellm
+    from .core import create_model, run_agent
+    from .default_tools import TOOLS
+    from .tools import get_tool, load_tools, load_code
+    from .codegen import (
+        TestFileWriter,
+        generate_python_header,
+        reformat_python,
+        generate_python_tool_call,
+        generate_explain_header,
+        generate_explain_action_step,
+    )
+    from ftl_pytest_agent.memory import ActionStep
+    from smolagents.agent_types import AgentText
 
     tool_classes = {}
     tool_classes.update(TOOLS)
@@ -45,6 +48,9 @@ def main(
     state = {
     }
 
+    output = TestFileWriter(output)
+    explain = TestFileWriter(explain)
+
     generate_python_header(
         output,
         problem,
@@ -64,7 +70,10 @@ def main(
             if o.trace and o.tool_calls:
                 for call in o.tool_calls:
                     generate_python_tool_call(output, call)
+            output.flush()
+            explain.flush()
         elif isinstance(o, AgentText):
             print(o.to_string())
 
     reformat_python(output)
+    explain.close()
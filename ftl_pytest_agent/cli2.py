@@ -1,10 +1,54 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-from ftl_pytest_agent.util import get_functions
 
-from .testgen import generate_test
+
+def run_job(job, session):
+    fn_name, tools, prompt, output, explain = job
+    start = time.time()
+    try:
+        session.generate(tools, prompt, output, explain)
+        status = "ok"
+    except Exception as e:
+        status = f"error: {type(e).__name__}: {e}"
+    return fn_name, output, status, time.time() - start
+
+
+def run_jobs(job_list, session, jobs):
+    if jobs > 1:
+        # Each job writes only its own test_<fn>.py/.txt pair and results are
+        # collected in submission order so the summary is deterministic.
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(run_job, job, session) for job in job_list]
+            return [future.result() for future in futures]
+    return [run_job(job, session) for job in job_list]
+
+
+def retry_job(job, result, max_failure_length=2000):
+    fn_name, tools, prompt, output, explain = job
+    failure = "\n".join(result.failures)[-max_failure_length:]
+    prompt += f"\nA previous attempt wrote a test that did not pass ({result.status}), avoid its mistake:\n{failure}\n"
+    return fn_name, tools, prompt, output, explain
+
+
+def print_summary(results):
+    width = max([len("function")] + [len(r[0]) for r in results])
+    print()
+    print(f"{'function':<{width}}  {'output':<{width + 8}}  {'duration':>8}  status")
+    for fn_name, output, status, duration in results:
+        print(f"{fn_name:<{width}}  {output:<{width + 8}}  {duration:>7.1f}s  {status}")
+
+
+def print_verification(verified):
+    width = max([len("test file")] + [len(path) for path in verified])
+    print()
+    print(f"{'test file':<{width}}  {'duration':>8}  status")
+    for path, result in verified.items():
+        print(f"{path:<{width}}  {result.duration:>7.2f}s  {result.status}")
 
 
 @click.command()
@@ -13,24 +57,119 @@ from .testgen import generate_test
 @click.option("--function", "-f", default=None)
 @click.option("--additional-info", "-a", default=None)
 @click.option("--llm-api-base", default=None)
-def main(model, code_file, function, additional_info, llm_api_base):
+@click.option("--jobs", "-j", default=1, help="Number of functions to generate tests for concurrently")
+@click.option("--context", default=8192, help="Context window of the model in tokens")
+@click.option(
+    "--context-policy",
+    type=click.Choice(["summarize", "drop_observations", "last_steps"]),
+    default=None,
+    help="How to shrink the prompt when it does not fit the context window",
+)
+@click.option("--static", is_flag=True, help="Find the functions by parsing the code file instead of importing it")
+@click.option("--list", "list_functions", is_flag=True, help="List the functions found in the code file and exit")
+@click.option(
+    "--cache",
+    "cache_mode",
+    type=click.Choice(["readwrite", "record", "replay"]),
+    default=None,
+    help="Serve repeated model requests from the response cache, replay fails on a miss",
+)
+@click.option("--cache-file", default=None, help="Response cache database, defaults to ~/.cache/ftl-pytest-agent/responses.sqlite")
+@click.option("--candidates", default=1, help="Completions requested per step, the first that completes is kept")
+@click.option("--warm-workers", default=0, help="Run code actions in this many forked workers with the code file preloaded")
+@click.option("--verify", is_flag=True, help="Run the generated tests with pytest once they are written")
+@click.option("--retries", default=0, help="Generate a test again, with the failure in the prompt, when it does not pass")
+@click.option("--isolated", is_flag=True, help="Run each agent in a fork of a process with the code file imported, same as --warm-workers 1")
+def main(
+    model,
+    code_file,
+    function,
+    additional_info,
+    llm_api_base,
+    jobs,
+    context,
+    context_policy,
+    static,
+    list_functions,
+    cache_mode,
+    cache_file,
+    candidates,
+    warm_workers,
+    verify,
+    retries,
+    isolated,
+):
+    if list_functions:
+        from .util import get_functions_static
+
+        module, fns = get_functions_static(code_file)
+        for fn in fns:
+            print(f"{module.__name__}.{fn.__name__}{fn.signature}")
+        return
+
+    if candidates > 1 and (warm_workers or isolated):
+        # Workers run the code actions in other processes, where the interpreter state cannot be forked per candidate
+        raise click.UsageError("--candidates cannot be combined with --warm-workers or --isolated")
+
+    # Imported here so --help does not load smolagents and litellm
+    from .testgen import TestGenSession
+
     print(code_file)
-    module, fns = get_functions(code_file)
+    session = TestGenSession(
+        model,
+        code_file,
+        llm_api_base,
+        context=context,
+        context_policy=context_policy,
+        static=static,
+        cache_mode=cache_mode,
+        cache_path=cache_file,
+        num_candidates=candidates,
+        warm_workers=max(warm_workers, 1) if isolated else warm_workers,
+    )
+    module, fns = session.module, session.fns
     print(module.__name__, [fn.__name__ for fn in fns])
 
+    additional = None
+    if additional_info:
+        with open(additional_info) as f:
+            additional = f.read()
+
+    job_list = []
     for fn in fns:
         fn_name = fn.__name__
         if (function and fn_name == function) or function is None:
             fn_doc = fn.__doc__
             tools = ['complete', fn_name]
             prompt = f"Call {fn_name} with suitable arguments, use assert statement on the result to make sure it is correct, and then complete.  Consider the docstring for {fn_name} in your work:\n{fn_doc}\n"
-            if additional_info:
-                with open(additional_info) as f:
-                    prompt += "\nConsider this additional info as well:\n"
-                    prompt += f.read()
+            if additional:
+                prompt += "\nConsider this additional info as well:\n"
+                prompt += additional
             output = f"test_{fn_name}.py"
             explain = f"test_{fn_name}.txt"
-            generate_test(model, code_file, tools, prompt, output, explain, llm_api_base)
+            job_list.append((fn_name, tools, prompt, output, explain))
+
+    try:
+        results = run_jobs(job_list, session, jobs)
+        verified = None
+        if verify or retries:
+            verified = session.verify([job[3] for job in job_list], workers=jobs)
+            for attempt in range(retries):
+                failed = [job for job in job_list if not verified[job[3]].ok]
+                if not failed:
+                    break
+                print(f"retry {attempt + 1}: {', '.join(job[0] for job in failed)}")
+                retried = {r[0]: r for r in run_jobs([retry_job(job, verified[job[3]]) for job in failed], session, jobs)}
+                results = [retried.get(r[0], r) for r in results]
+                verified.update(session.verify([job[3] for job in failed], workers=jobs))
+    finally:
+        session.close()
+
+    print_summary(results)
+    if verified is not None:
+        print_verification(verified)
+    if cache_mode:
+        print(f"response cache: {session.model.hits} hits, {session.model.misses} misses")
 
 
 if __name__ == "__main__":
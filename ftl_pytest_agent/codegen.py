@@ -1,60 +1,127 @@
-import os
-
+import logging
 
 from .util import get_functions
 
+
+logger = logging.getLogger(__name__)
+
+
+class TestFileWriter:
+    """
+    Keeps a generated file in memory and writes it to `path` only when flushed.
+
+    Callers flush at step boundaries and close when done, the current content is available as `text` at any time
+    without reading the file back.
+    """
+
+    # Not a test class, even though the name starts with Test
+    __test__ = False
+
+    def __init__(self, path):
+        self.path = path
+        self._parts = []
+        self._flushed = 0
+        self._truncate = True
+
+    def write(self, text):
+        self._parts.append(text)
+
+    @property
+    def text(self):
+        if len(self._parts) > 1:
+            self._parts[:] = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def flush(self):
+        text = self.text
+        if self._flushed == len(text) and not self._truncate:
+            return
+        with open(self.path, "w" if self._truncate else "a") as f:
+            f.write(text[self._flushed:])
+        self._flushed = len(text)
+        self._truncate = False
+
+    def replace(self, text):
+        """Replaces the whole content, the file is rewritten on the next flush."""
+        if text != self.text:
+            self._parts[:] = [text]
+            self._flushed = 0
+            self._truncate = True
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def generate_python_header(
     output,
     problem,
     tools_files,
     code_files,
     tools,
+    modules=None,
 ):
 
-    with open(output, "w") as f:
-        f.write("#!/usr/bin/env python3\n")
-        if problem:
-            f.write('"""\n')
-            f.write(f"Problem:{problem}\n")
-            f.write('"""\n')
-
-        for code_file in code_files:
-            module, fns = get_functions(code_file)
-            module_name = module.__name__
-            fns = ", ".join([fn.__name__ for fn in fns])
-            f.write(f"from {module_name} import {fns}")
-
-            f.write(
-                """
+    if modules is None:
+        modules = [get_functions(code_file) for code_file in code_files]
+
+    output.write("#!/usr/bin/env python3\n")
+    if problem:
+        output.write('"""\n')
+        output.write(f"Problem:{problem}\n")
+        output.write('"""\n')
+
+    for module, fns in modules:
+        module_name = module.__name__
+        fns = ", ".join([fn.__name__ for fn in fns])
+        output.write(f"from {module_name} import {fns}")
+
+        output.write(
+            """
 def complete(message: str=None):
   print(message)\n"""
-            )
+        )
 
-        f.write("\n\ndef test():\n")
+    output.write("\n\ndef test():\n")
 
 
 def generate_python_tool_call(output, call):
-    with open(output, "a") as f:
-        f.write("\n    ")
-        f.write("\n    ".join(call.arguments.strip().split("\n")))
-        f.write("\n")
+    output.write("\n    ")
+    output.write("\n    ".join(call.arguments.strip().split("\n")))
+    output.write("\n")
+
+
+def format_python(text):
+    """Formats Python source with black in this process, the text is returned unchanged if black can't parse it."""
+    # black is only needed once a test has been generated, so keep it out of startup
+    import black
+
+    try:
+        return black.format_str(text, mode=black.Mode())
+    except black.InvalidInput as e:
+        logger.warning(f"Cannot format generated code: {e}")
+        return text
 
 
 def reformat_python(output):
-    os.system("black " + output)
+    output.replace(format_python(output.text))
+    output.flush()
 
 
 def generate_explain_header(explain, problem):
-    with open(explain, "w") as f:
-        if problem:
-            f.write("Problem: {problem}\n\n")
+    if problem:
+        explain.write(f"Problem: {problem}\n\n")
 
 
 def generate_explain_action_step(explain, o):
     if o.model_output:
-        with open(explain, "a") as f:
-            f.write(f"Step {o.step_number:2d} ")
-            f.write("-" * 100)
-            f.write("\n\n")
-            f.write(o.model_output)
-            f.write("\n\n")
+        explain.write(f"Step {o.step_number:2d} ")
+        explain.write("-" * 100)
+        explain.write("\n\n")
+        explain.write(o.model_output)
+        explain.write("\n\n")
@@ -1,33 +1,95 @@
-from ftl_pytest_agent.agents import CodeAgent
-from smolagents import LiteLLMModel
-import yaml
-import importlib.resources
+from ftl_pytest_agent.agents import CodeAgent, load_prompt_templates
+from ftl_pytest_agent.budget import ContextBudget
+from ftl_pytest_agent.models import CachingModel, LiteLLMModel
+from ftl_pytest_agent.response_cache import ResponseCache
+import asyncio
 
 
-def create_model(model_id, context=8192, llm_api_base=None):
+def create_model(model_id, context=8192, llm_api_base=None, cache_mode=None, cache_path=None):
 
-    return LiteLLMModel(
+    model = LiteLLMModel(
         model_id=model_id,
         num_ctx=context,
         api_base=llm_api_base,
     )
+    if cache_mode is None:
+        return model
+    return CachingModel(model, ResponseCache(cache_path), mode=cache_mode)
 
 
-def make_agent(tools, model):
-    prompt_templates = yaml.safe_load(
-        importlib.resources.files("ftl_pytest_agent.prompts").joinpath("code_agent.yaml").read_text()
-    )
+def create_context_budget(context=8192, policy="summarize"):
+    if policy is None:
+        return None
+    return ContextBudget.for_context(context, policy=policy)
+
+
+def make_agent(tools, model, context_budget=None, num_candidates=1, stream_outputs=False, interpreter_pool=None):
+    prompt_templates = load_prompt_templates("ftl_pytest_agent.prompts", "code_agent.yaml")
+    # Only whether something was called is used, so don't keep the arguments alive
+    max_trace_repr_length = 200
+    python_executor = None
+    if interpreter_pool is not None:
+        python_executor = interpreter_pool.interpreter(tools, max_trace_repr_length=max_trace_repr_length)
     agent = CodeAgent(
         tools=tools,
         model=model,
         verbosity_level=4,
         prompt_templates=prompt_templates,
+        context_budget=context_budget,
+        max_trace_repr_length=max_trace_repr_length,
+        num_candidates=num_candidates,
+        stream_outputs=stream_outputs,
+        python_executor=python_executor,
     )
     return agent
 
 
-def run_agent(tools, model, problem_statement):
-    agent = make_agent(tools, model)
-    return agent.run(problem_statement, stream=True)
+def _close_executor(agent, interpreter_pool):
+    # Interpreters of the pool are made for the agent, closing one ends its worker process
+    if interpreter_pool is not None:
+        agent.python_executor.close()
+
+
+def run_agent(tools, model, problem_statement, context_budget=None, num_candidates=1, interpreter_pool=None):
+    agent = make_agent(
+        tools,
+        model,
+        context_budget=context_budget,
+        num_candidates=num_candidates,
+        interpreter_pool=interpreter_pool,
+    )
+    try:
+        yield from agent.run(problem_statement, stream=True)
+    finally:
+        _close_executor(agent, interpreter_pool)
+
+
+async def arun_agent(tools, model, problem_statement, context_budget=None, num_candidates=1, interpreter_pool=None):
+    agent = make_agent(
+        tools,
+        model,
+        context_budget=context_budget,
+        num_candidates=num_candidates,
+        interpreter_pool=interpreter_pool,
+    )
+    try:
+        async for output in agent.arun(problem_statement):
+            yield output
+    finally:
+        _close_executor(agent, interpreter_pool)
+
+
+async def gather_runs(runs, limit=None):
+    """Drives several `arun_agent` generators on one event loop and returns the outputs of each run."""
+
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def collect(run):
+        if semaphore is None:
+            return [o async for o in run]
+        async with semaphore:
+            return [o async for o in run]
+
+    return await asyncio.gather(*[collect(run) for run in runs])
 
 
@@ -0,0 +1,148 @@
+"""
+Fork server: a template process that is warmed up once and forked for every isolated task.
+
+The warm-up function runs in the template, for instance to import the code file under test with `load_code`, and
+its result is inherited by every fork. A fork sees the modules and objects of the template copy-on-write, so what it
+changes, like the globals of the module under test, does not leak into the template or the other forks, and it
+starts without paying for the imports again.
+
+Forking needs a POSIX system.
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import traceback
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class ForkError(Exception):
+    """An exception raised by a function run in a fork, with the traceback formatted in the fork."""
+
+
+def _template_main(address, authkey, warmup, warmup_args):
+    # Connected before warming up, so the server hears about a warm-up that fails
+    control = Client(address, family="AF_UNIX", authkey=authkey)
+    try:
+        context = warmup(*warmup_args) if warmup is not None else None
+    except Exception as e:
+        control.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    # Forks are never waited for
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    control.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            command = control.recv()
+        except EOFError:
+            return
+        if command == "exit":
+            return
+        _, target, args = command
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            status = 0
+            try:
+                target(Client(address, family="AF_UNIX", authkey=authkey), context, *args)
+            except BaseException:
+                logger.exception(f"Fork running {target.__name__} failed")
+                status = 1
+            finally:
+                os._exit(status)
+        control.send(pid)
+
+
+def _call_main(conn, context, func, args):
+    try:
+        result = ("ok", func(context, *args))
+    except Exception as e:
+        result = ("error", f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+    conn.send(result)
+    conn.close()
+
+
+class ForkServer:
+    """
+    Forks isolated processes from a warm template.
+
+    Args:
+        warmup (`Callable`, *optional*): Run once in the template, its result is passed to every forked target.
+        warmup_args (`tuple`): Arguments of `warmup`.
+
+    Targets and their arguments are pickled to the template, so they must be importable functions.
+    """
+
+    def __init__(self, warmup: Callable = None, warmup_args: Tuple = ()):
+        self._lock = threading.Lock()
+        self._dir = tempfile.mkdtemp(prefix="ftl-forkserver-")
+        self._authkey = os.urandom(32)
+        self._listener = Listener(os.path.join(self._dir, "server"), family="AF_UNIX", authkey=self._authkey)
+        self._control = None
+        self._template = multiprocessing.get_context("fork").Process(
+            target=_template_main,
+            args=(self._listener.address, self._authkey, warmup, warmup_args),
+            daemon=True,
+        )
+        self._template.start()
+        self._control = self._listener.accept()
+        status = self._control.recv()
+        if status[0] != "ready":
+            self.close()
+            raise RuntimeError(f"Fork server failed to start: {status[1]}")
+        self.pid = status[1]
+
+    def fork(self, target: Callable, *args) -> Tuple[Any, int]:
+        """
+        Forks the template to run `target(conn, context, *args)`, where `context` is the result of the warm-up.
+
+        Returns the connection to the fork, the other end of `conn`, and its pid.
+        """
+        with self._lock:
+            self._control.send(("fork", target, args))
+            conn = self._listener.accept()
+            return conn, self._control.recv()
+
+    def call(self, func: Callable, *args) -> Any:
+        """Returns `func(context, *args)` run in a fork. Its exceptions are raised as `ForkError`."""
+        conn, pid = self.fork(_call_main, func, args)
+        try:
+            status, result = conn.recv()
+        except EOFError:
+            raise ForkError(f"Fork {pid} running {func.__name__} exited without a result")
+        finally:
+            conn.close()
+        if status == "error":
+            raise ForkError(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._control is not None and not self._control.closed:
+                try:
+                    self._control.send("exit")
+                except OSError:
+                    pass
+                self._control.close()
+        self._template.join(timeout=5)
+        self._listener.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+__all__ = ["ForkServer", "ForkError"]
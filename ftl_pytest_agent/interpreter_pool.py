@@ -0,0 +1,200 @@
+"""
+Pool of warm interpreter processes.
+
+The pool runs a `ForkServer` whose template imports the code files under test, their tools and the authorized
+modules once. Every interpreter handed out by the pool runs in a fork of the template, so it starts with all of that
+already imported and with a clean state. Code actions are sent to it over a pipe and it answers like
+`LocalPythonInterpreter.__call__`.
+"""
+
+import logging
+import pickle
+import threading
+from importlib import import_module
+from typing import Any, Dict, Iterable, Tuple
+
+from smolagents.utils import BASE_BUILTIN_MODULES
+
+from ftl_pytest_agent.forkserver import ForkServer
+from ftl_pytest_agent.local_python_executor import InterpreterError
+
+
+logger = logging.getLogger(__name__)
+
+
+def _picklable(value: Any) -> Any:
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        return repr(value)
+
+
+def _load_tool_classes(code_files, tools_files) -> Dict[str, Any]:
+    from .default_tools import TOOLS
+    from .tools import load_code, load_tools
+
+    tool_classes = dict(TOOLS)
+    for tools_file in tools_files:
+        tool_classes.update(load_tools(tools_file))
+    for code_file in code_files:
+        tool_classes.update(load_code(code_file))
+    return tool_classes
+
+
+def _warmup(code_files, tools_files, preload) -> Dict[str, Any]:
+    tool_classes = _load_tool_classes(code_files, tools_files)
+    import_module("smolagents.default_tools")
+    for name in preload:
+        try:
+            import_module(name)
+        except ImportError as e:
+            logger.warning(f"Cannot preload {name}: {e}")
+    return tool_classes
+
+
+def _worker_main(conn, tool_classes):
+    from smolagents.default_tools import FinalAnswerTool
+
+    from .local_python_executor import LocalPythonInterpreter
+    from .tools import get_tool
+
+    try:
+        _, tool_names, interpreter_kwargs = conn.recv()
+    except EOFError:
+        return
+    try:
+        state = {}
+        tools = {}
+        for name in tool_names:
+            tool = get_tool(tool_classes, name, state)
+            tools[tool.name] = tool
+        tools.setdefault("final_answer", FinalAnswerTool())
+        interpreter = LocalPythonInterpreter(tools=tools, **interpreter_kwargs)
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}", ""))
+        return
+    conn.send(("ready",))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "close":
+            return
+        _, code_action, additional_variables = message
+        try:
+            output, logs, is_final_answer, trace = interpreter(code_action, additional_variables)
+        except Exception as e:
+            conn.send(("error", str(e), str(interpreter.state.get("_print_outputs", ""))))
+            continue
+        conn.send(("ok", _picklable(output), logs, is_final_answer, _picklable(trace), interpreter.operations_count))
+
+
+class RemoteInterpreter:
+    """
+    An interpreter running in a worker process of an `InterpreterPool`, called like `LocalPythonInterpreter`.
+
+    Outputs and traces that cannot be pickled are returned as their repr. `state` only holds the print outputs of the
+    last call.
+    """
+
+    def __init__(self, conn, pid: int):
+        self.conn = conn
+        self.pid = pid
+        self.state = {}
+        self.operations_count = 0
+
+    def __call__(self, code_action: str, additional_variables: Dict) -> Tuple[Any, str, bool, Any]:
+        try:
+            self.conn.send(("run", code_action, additional_variables))
+            reply = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise InterpreterError(f"Interpreter worker {self.pid} exited: {e}")
+        if reply[0] == "error":
+            _, message, logs = reply
+            self.state["_print_outputs"] = logs
+            raise InterpreterError(message)
+        _, output, logs, is_final_answer, trace, self.operations_count = reply
+        self.state["_print_outputs"] = logs
+        return output, logs, is_final_answer, trace
+
+    def close(self):
+        if self.conn.closed:
+            return
+        try:
+            self.conn.send(("close",))
+        except OSError:
+            pass
+        self.conn.close()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InterpreterPool:
+    """
+    Hands out interpreters forked from a warm template process.
+
+    Args:
+        code_files (`list[str]`): Code files whose functions are available as tools.
+        tools_files (`list[str]`): Tool files, as loaded by `load_tools`.
+        preload (`list[str]`): Modules imported by the template, in addition to the base authorized modules.
+        size (`int`): Number of workers kept forked and waiting, so handing one out does not wait for a fork.
+    """
+
+    def __init__(self, code_files: Iterable[str] = (), tools_files: Iterable[str] = (), preload: Iterable[str] = (), size: int = 1):
+        self.size = size
+        self._lock = threading.Lock()
+        self._spares = []
+        self.server = ForkServer(
+            _warmup,
+            (list(code_files), list(tools_files), list(BASE_BUILTIN_MODULES) + list(preload)),
+        )
+        self._fill()
+
+    def _fill(self):
+        with self._lock:
+            while len(self._spares) < self.size:
+                self._spares.append(self.server.fork(_worker_main))
+
+    def interpreter(self, tools: Iterable, **interpreter_kwargs) -> RemoteInterpreter:
+        """
+        Returns an interpreter with a fresh state and the given tools, by name or as `Tool`s of the loaded files.
+
+        `interpreter_kwargs` are passed to `LocalPythonInterpreter` in the worker.
+        """
+        with self._lock:
+            conn, pid = self._spares.pop() if self._spares else self.server.fork(_worker_main)
+        interpreter_kwargs.setdefault("additional_authorized_imports", [])
+        tool_names = [getattr(tool, "name", tool) for tool in tools]
+        conn.send(("start", [name for name in tool_names if name != "final_answer"], interpreter_kwargs))
+        reply = conn.recv()
+        if reply[0] != "ready":
+            conn.close()
+            raise InterpreterError(f"Cannot start interpreter: {reply[1]}")
+        self._fill()
+        return RemoteInterpreter(conn, pid)
+
+    def close(self):
+        with self._lock:
+            for conn, _ in self._spares:
+                conn.close()
+            self._spares = []
+        self.server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+__all__ = ["InterpreterPool", "RemoteInterpreter"]
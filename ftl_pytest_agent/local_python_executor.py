@@ -23,20 +23,26 @@
 
 import ast
 import builtins
+import copy
 import difflib
+import hashlib
 import inspect
 import logging
 import math
+import operator
 import re
+import sys
+import threading
+from collections import OrderedDict, deque
 from collections.abc import Mapping
+from contextvars import ContextVar
+from functools import lru_cache
 from importlib import import_module
 from types import ModuleType
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from weakref import WeakKeyDictionary
 
-import numpy as np
-import pandas as pd
-
-from smolagents.utils import BASE_BUILTIN_MODULES, truncate_content
+from smolagents.utils import BASE_BUILTIN_MODULES
 
 
 logger = logging.getLogger(__name__)
@@ -58,10 +64,77 @@ ERRORS = {
 }
 
 DEFAULT_MAX_LEN_OUTPUT = 50000
+DEFAULT_PARSE_CACHE_SIZE = 128
+DEFAULT_MAX_TRACE_ENTRIES = 10000
+# Per code action: the count starts again for every evaluate_python_code run, it used to add up over the whole state
 MAX_OPERATIONS = 10000000
 MAX_WHILE_ITERATIONS = 1000000
 
 
+class OperationCounter:
+    """Number of AST nodes evaluated, kept out of the user-visible state."""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+# Counter of the evaluation running in the current context, set by evaluate_python_code for each run and reset
+# afterwards. A shared default would leak counts between interpreters and threads.
+_operations: ContextVar[Optional[OperationCounter]] = ContextVar("operations", default=None)
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.FloorDiv: operator.floordiv,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
+
+INPLACE_OPERATORS = {
+    ast.Add: operator.iadd,
+    ast.Sub: operator.isub,
+    ast.Mult: operator.imul,
+    ast.Div: operator.itruediv,
+    ast.Mod: operator.imod,
+    ast.Pow: operator.ipow,
+    ast.FloorDiv: operator.ifloordiv,
+    ast.BitAnd: operator.iand,
+    ast.BitOr: operator.ior,
+    ast.BitXor: operator.ixor,
+    ast.LShift: operator.ilshift,
+    ast.RShift: operator.irshift,
+}
+
+COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+
 def custom_print(*args):
     return None
 
@@ -123,29 +196,156 @@ BASE_PYTHON_TOOLS = {
 
 
 class PrintContainer:
-    def __init__(self):
+    """
+    Print outputs of a code action, bounded to `max_length` characters while they are written.
+
+    Up to `max_length` characters the output is kept as is. Past that, only the first half and the last half are kept
+    and the string representation is the same as `truncate_content` would give for the whole output.
+    """
+
+    def __init__(self, max_length: Optional[int] = None):
+        if max_length is not None and max_length < 0:
+            raise ValueError(f"max_length must be None or at least 0, got {max_length}")
+        self.max_length = max_length
         self.value = ""
 
+    @property
+    def value(self) -> str:
+        return str(self)
+
+    @value.setter
+    def value(self, text: str):
+        self._chunks = []
+        self._head = None
+        self._tail = deque()
+        self._tail_length = 0
+        self._length = 0
+        self.append(text)
+
     def append(self, text):
-        self.value += text
+        if not text:
+            return self
+        self._length += len(text)
+        if self._head is not None:
+            self._append_tail(text)
+        elif self.max_length is not None and self._length > self.max_length:
+            # From here on the middle of the output is dropped
+            content = "".join(self._chunks) + text
+            self._chunks = []
+            self._head = content[: self.max_length // 2]
+            self._append_tail(content[self.max_length // 2:])
+        else:
+            self._chunks.append(text)
         return self
 
+    def _append_tail(self, text):
+        tail_size = self.max_length - self.max_length // 2
+        if tail_size == 0:
+            # max_length 0 keeps nothing
+            return
+        if len(text) > tail_size:
+            text = text[-tail_size:]
+        self._tail.append(text)
+        self._tail_length += len(text)
+        while self._tail and self._tail_length - len(self._tail[0]) >= tail_size:
+            self._tail_length -= len(self._tail.popleft())
+
     def __iadd__(self, other):
         """Implements the += operator"""
-        self.value += str(other)
-        return self
+        return self.append(str(other))
 
     def __str__(self):
         """String representation"""
-        return self.value
+        if self._head is None:
+            return "".join(self._chunks)
+        tail = "".join(self._tail)
+        return (
+            self._head
+            + f"\n..._This content has been truncated to stay below {self.max_length} characters_...\n"
+            + tail[len(tail) - (self.max_length - self.max_length // 2):]
+        )
 
     def __repr__(self):
         """Representation for debugging"""
-        return f"PrintContainer({self.value})"
+        return f"PrintContainer({self})"
 
     def __len__(self):
         """Implements len() function support"""
-        return len(self.value)
+        if self._head is None:
+            return self._length
+        return len(str(self))
+
+
+class TraceCall:
+    """One call recorded by a `TraceRecorder`."""
+
+    __slots__ = ("func_name", "args", "kwargs")
+
+    def __init__(self, func_name: str, args: tuple, kwargs: dict):
+        self.func_name = func_name
+        self.args = args
+        self.kwargs = kwargs
+
+    def dict(self):
+        return {"func_name": self.func_name, "args": list(self.args), "kwargs": dict(self.kwargs)}
+
+    def __repr__(self):
+        return f"TraceCall({self.dict()})"
+
+
+class TraceRecorder:
+    """
+    Calls made by a code action, with a cap on the number of entries.
+
+    Args:
+        names (`set[str]`, *optional*): Only calls to these names are recorded, all calls if not given.
+        max_entries (`int`): Calls past this number are counted in `dropped` but not recorded.
+        max_repr_length (`int`, *optional*): If given, arguments are stored as their repr truncated to this length
+            instead of keeping references to the objects.
+    """
+
+    def __init__(
+        self,
+        names: Optional[set] = None,
+        max_entries: int = DEFAULT_MAX_TRACE_ENTRIES,
+        max_repr_length: Optional[int] = None,
+    ):
+        self.names = names
+        self.max_entries = max_entries
+        self.max_repr_length = max_repr_length
+        self.calls: List[TraceCall] = []
+        self.dropped = 0
+
+    def _compact(self, value):
+        text = repr(value)
+        if len(text) > self.max_repr_length:
+            text = text[: self.max_repr_length] + "..."
+        return text
+
+    def record(self, func_name: Optional[str], args: list, kwargs: dict):
+        if self.names is not None and func_name not in self.names:
+            return
+        if len(self.calls) >= self.max_entries:
+            self.dropped += 1
+            return
+        if self.max_repr_length is not None:
+            args = tuple(self._compact(arg) for arg in args)
+            kwargs = {key: self._compact(value) for key, value in kwargs.items()}
+        else:
+            args = tuple(args)
+        self.calls.append(TraceCall(func_name, args, kwargs))
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __iter__(self):
+        return iter(self.calls)
+
+    def __getitem__(self, index):
+        return self.calls[index]
+
+    def __repr__(self):
+        return f"TraceRecorder({len(self.calls)} calls, {self.dropped} dropped)"
 
 
 class BreakException(Exception):
@@ -206,16 +406,112 @@ def evaluate_unaryop(
     authorized_imports: List[str],
 ) -> Any:
     operand = evaluate_ast(expression.operand, state, static_tools, custom_tools, authorized_imports)
-    if isinstance(expression.op, ast.USub):
-        return -operand
-    elif isinstance(expression.op, ast.UAdd):
-        return operand
-    elif isinstance(expression.op, ast.Not):
-        return not operand
-    elif isinstance(expression.op, ast.Invert):
-        return ~operand
-    else:
+    unary_operator = UNARY_OPERATORS.get(type(expression.op))
+    if unary_operator is None:
         raise InterpreterError(f"Unary operation {expression.op.__class__.__name__} is not supported.")
+    return unary_operator(operand)
+
+
+class Scope(dict):
+    """
+    Local frame of an interpreted function, lambda or comprehension.
+
+    Names are assigned in the frame itself and looked up in `parent` when they are not found locally, so calls don't
+    need a copy of the enclosing state.
+    """
+
+    __slots__ = ("parent",)
+
+    def __init__(self, parent: Dict[str, Any], local: Optional[Dict[str, Any]] = None):
+        super().__init__(local or ())
+        self.parent = parent
+
+    def __missing__(self, key):
+        return self.parent[key]
+
+    def __delitem__(self, key):
+        # Names of the enclosing state can't be deleted from a frame, as with a global deleted in a Python function
+        if not dict.__contains__(self, key):
+            raise InterpreterError(f"Cannot delete name '{key}': name is not defined")
+        dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return dict.keys(self) | self.parent.keys()
+
+
+class ForkState(Scope):
+    """
+    State of an `InterpreterFork`: a `Scope` over the state of the interpreter it was forked from.
+
+    Names assigned or deleted by the fork are kept in it. A value of the parent state is copied into it the first time
+    the fork reads it, so mutating it in place does not change the parent either. Values that cannot be deep-copied,
+    like modules, are shared.
+    """
+
+    __slots__ = ("deleted", "committed", "_memo")
+
+    def __init__(self, parent: Dict[str, Any]):
+        super().__init__(parent)
+        self.deleted = set()
+        self.committed = False
+        # Values that reference each other keep pointing to the same copies
+        self._memo = {}
+
+    def __missing__(self, key):
+        if key in self.deleted:
+            raise KeyError(key)
+        value = self.parent[key]
+        try:
+            value = copy.deepcopy(value, self._memo)
+        except Exception:
+            pass
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.deleted.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise InterpreterError(f"Cannot delete name '{key}': name is not defined")
+        dict.pop(self, key, None)
+        self.deleted.add(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key not in self.deleted and key in self.parent)
+
+    def keys(self):
+        return dict.keys(self) | (self.parent.keys() - self.deleted)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+# State of the fork running in this context, see `_function_state`
+_active_fork: ContextVar[Optional[ForkState]] = ContextVar("active_fork", default=None)
+
+
+def _function_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    State that a function defined on `state` looks its globals up in when it is called.
+
+    A function defined before a fork runs on the state of the fork when the fork calls it, and one defined in a fork
+    runs on the interpreter state once the fork is committed.
+    """
+    if type(state) is ForkState and state.committed:
+        state = state.parent
+    forked = _active_fork.get()
+    if forked is not None and forked.parent is state:
+        return forked
+    return state
 
 
 def evaluate_lambda(
@@ -228,9 +524,7 @@ def evaluate_lambda(
     args = [arg.arg for arg in lambda_expression.args.args]
 
     def lambda_func(*values: Any) -> Any:
-        new_state = state.copy()
-        for arg, value in zip(args, values):
-            new_state[arg] = value
+        new_state = Scope(_function_state(state), dict(zip(args, values)))
         return evaluate_ast(
             lambda_expression.body,
             new_state,
@@ -271,15 +565,16 @@ def create_function(
     custom_tools: Dict[str, Callable],
     authorized_imports: List[str],
 ) -> Callable:
-    def new_func(*args: Any, **kwargs: Any) -> Any:
-        func_state = state.copy()
-        arg_names = [arg.arg for arg in func_def.args.args]
-        default_values = [
-            evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) for d in func_def.args.defaults
-        ]
+    arg_names = [arg.arg for arg in func_def.args.args]
+    # Defaults are evaluated once, when the function is defined
+    default_values = [
+        evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) for d in func_def.args.defaults
+    ]
+    defaults = dict(zip(arg_names[-len(default_values):], default_values)) if default_values else {}
 
-        # Apply default values
-        defaults = dict(zip(arg_names[-len(default_values):], default_values))
+    def new_func(*args: Any, **kwargs: Any) -> Any:
+        # Default values for arguments that are not provided
+        func_state = Scope(_function_state(state), defaults)
 
         # Set positional arguments
         for name, value in zip(arg_names, args):
@@ -298,11 +593,6 @@ def create_function(
             kwarg_name = func_def.args.kwarg.arg
             func_state[kwarg_name] = kwargs
 
-        # Set default values for arguments that were not provided
-        for name, value in defaults.items():
-            if name not in func_state:
-                func_state[name] = value
-
         # Update function state with self and __class__
         if func_def.args.args and func_def.args.args[0].arg == "self":
             if args:
@@ -402,37 +692,12 @@ def evaluate_augassign(
     current_value = get_current_value(expression.target)
     value_to_add = evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
 
-    if isinstance(expression.op, ast.Add):
-        if isinstance(current_value, list):
-            if not isinstance(value_to_add, list):
-                raise InterpreterError(f"Cannot add non-list value {value_to_add} to a list.")
-            current_value += value_to_add
-        else:
-            current_value += value_to_add
-    elif isinstance(expression.op, ast.Sub):
-        current_value -= value_to_add
-    elif isinstance(expression.op, ast.Mult):
-        current_value *= value_to_add
-    elif isinstance(expression.op, ast.Div):
-        current_value /= value_to_add
-    elif isinstance(expression.op, ast.Mod):
-        current_value %= value_to_add
-    elif isinstance(expression.op, ast.Pow):
-        current_value **= value_to_add
-    elif isinstance(expression.op, ast.FloorDiv):
-        current_value //= value_to_add
-    elif isinstance(expression.op, ast.BitAnd):
-        current_value &= value_to_add
-    elif isinstance(expression.op, ast.BitOr):
-        current_value |= value_to_add
-    elif isinstance(expression.op, ast.BitXor):
-        current_value ^= value_to_add
-    elif isinstance(expression.op, ast.LShift):
-        current_value <<= value_to_add
-    elif isinstance(expression.op, ast.RShift):
-        current_value >>= value_to_add
-    else:
+    inplace_operator = INPLACE_OPERATORS.get(type(expression.op))
+    if inplace_operator is None:
         raise InterpreterError(f"Operation {type(expression.op).__name__} is not supported.")
+    if isinstance(expression.op, ast.Add) and isinstance(current_value, list) and not isinstance(value_to_add, list):
+        raise InterpreterError(f"Cannot add non-list value {value_to_add} to a list.")
+    current_value = inplace_operator(current_value, value_to_add)
 
     # Update the state: current_value has been updated in-place
     set_value(
@@ -478,32 +743,10 @@ def evaluate_binop(
     right_val = evaluate_ast(binop.right, state, static_tools, custom_tools, authorized_imports)
 
     # Determine the operation based on the type of the operator in the BinOp
-    if isinstance(binop.op, ast.Add):
-        return left_val + right_val
-    elif isinstance(binop.op, ast.Sub):
-        return left_val - right_val
-    elif isinstance(binop.op, ast.Mult):
-        return left_val * right_val
-    elif isinstance(binop.op, ast.Div):
-        return left_val / right_val
-    elif isinstance(binop.op, ast.Mod):
-        return left_val % right_val
-    elif isinstance(binop.op, ast.Pow):
-        return left_val**right_val
-    elif isinstance(binop.op, ast.FloorDiv):
-        return left_val // right_val
-    elif isinstance(binop.op, ast.BitAnd):
-        return left_val & right_val
-    elif isinstance(binop.op, ast.BitOr):
-        return left_val | right_val
-    elif isinstance(binop.op, ast.BitXor):
-        return left_val ^ right_val
-    elif isinstance(binop.op, ast.LShift):
-        return left_val << right_val
-    elif isinstance(binop.op, ast.RShift):
-        return left_val >> right_val
-    else:
+    binary_operator = BINARY_OPERATORS.get(type(binop.op))
+    if binary_operator is None:
         raise NotImplementedError(f"Binary operation {type(binop.op).__name__} is not implemented.")
+    return binary_operator(left_val, right_val)
 
 
 def evaluate_assign(
@@ -636,7 +879,7 @@ def evaluate_call(
             raise InterpreterError("super() takes at most 2 arguments")
     else:
         if func_name == "print":
-            state["_print_outputs"] += " ".join(map(str, args)) + "\n"
+            state["_print_outputs"].append(" ".join(map(str, args)) + "\n")
             return None
         else:  # Assume it's a callable object
             if (
@@ -647,7 +890,9 @@ def evaluate_call(
                 raise InterpreterError(
                     f"Invoking a builtin function that has not been explicitly added as a tool is not allowed ({func_name})."
                 )
-            state['_trace'].append({'func_name': func_name, 'args': args, 'kwargs': kwargs})
+            trace = state.get("_trace")
+            if trace is not None:
+                trace.record(func_name, args, kwargs)
             return func(*args, **kwargs)
 
 
@@ -663,17 +908,21 @@ def evaluate_subscript(
 
     if isinstance(value, str) and isinstance(index, str):
         raise InterpreterError("You're trying to subscript a string with a string index, which is impossible")
-    if isinstance(value, pd.core.indexing._LocIndexer):
-        parent_object = value.obj
-        return parent_object.loc[index]
-    if isinstance(value, pd.core.indexing._iLocIndexer):
-        parent_object = value.obj
-        return parent_object.iloc[index]
-    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
-        return value[index]
-    elif isinstance(value, pd.core.groupby.generic.DataFrameGroupBy):
+    # Values can only be pandas or numpy objects if the code under test already imported them
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        if isinstance(value, pd.core.indexing._LocIndexer):
+            parent_object = value.obj
+            return parent_object.loc[index]
+        if isinstance(value, pd.core.indexing._iLocIndexer):
+            parent_object = value.obj
+            return parent_object.iloc[index]
+        if isinstance(value, (pd.DataFrame, pd.Series, pd.core.groupby.generic.DataFrameGroupBy)):
+            return value[index]
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray):
         return value[index]
-    elif isinstance(index, slice):
+    if isinstance(index, slice):
         return value[index]
     elif isinstance(value, (list, tuple)):
         if not (-len(value) <= index < len(value)):
@@ -727,28 +976,10 @@ def evaluate_condition(
     for i, (op, comparator) in enumerate(zip(condition.ops, condition.comparators)):
         op = type(op)
         right = evaluate_ast(comparator, state, static_tools, custom_tools, authorized_imports)
-        if op == ast.Eq:
-            current_result = left == right
-        elif op == ast.NotEq:
-            current_result = left != right
-        elif op == ast.Lt:
-            current_result = left < right
-        elif op == ast.LtE:
-            current_result = left <= right
-        elif op == ast.Gt:
-            current_result = left > right
-        elif op == ast.GtE:
-            current_result = left >= right
-        elif op == ast.Is:
-            current_result = left is right
-        elif op == ast.IsNot:
-            current_result = left is not right
-        elif op == ast.In:
-            current_result = left in right
-        elif op == ast.NotIn:
-            current_result = left not in right
-        else:
+        comparison_operator = COMPARISON_OPERATORS.get(op)
+        if comparison_operator is None:
             raise InterpreterError(f"Unsupported comparison operator: {op}")
+        current_result = comparison_operator(left, right)
 
         if current_result is False:
             return False
@@ -819,6 +1050,9 @@ def evaluate_listcomp(
     custom_tools: Dict[str, Callable],
     authorized_imports: List[str],
 ) -> List[Any]:
+    # The comprehension variables live in a single frame, rebound on every iteration
+    comprehension_state = Scope(state)
+
     def inner_evaluate(generators: List[ast.comprehension], index: int, current_state: Dict[str, Any]) -> List[Any]:
         if index >= len(generators):
             return [
@@ -840,20 +1074,19 @@ def evaluate_listcomp(
         )
         result = []
         for value in iter_value:
-            new_state = current_state.copy()
             if isinstance(generator.target, ast.Tuple):
                 for idx, elem in enumerate(generator.target.elts):
-                    new_state[elem.id] = value[idx]
+                    current_state[elem.id] = value[idx]
             else:
-                new_state[generator.target.id] = value
+                current_state[generator.target.id] = value
             if all(
-                evaluate_ast(if_clause, new_state, static_tools, custom_tools, authorized_imports)
+                evaluate_ast(if_clause, current_state, static_tools, custom_tools, authorized_imports)
                 for if_clause in generator.ifs
             ):
-                result.extend(inner_evaluate(generators, index + 1, new_state))
+                result.extend(inner_evaluate(generators, index + 1, current_state))
         return result
 
-    return inner_evaluate(listcomp.generators, 0, state)
+    return inner_evaluate(listcomp.generators, 0, comprehension_state)
 
 
 def evaluate_try(
@@ -962,36 +1195,42 @@ def evaluate_with(
             context.__exit__(None, None, None)
 
 
-def get_safe_module(raw_module, dangerous_patterns, authorized_imports, visited=None):
-    """Creates a safe copy of a module or returns the original if it's a function"""
-    # If it's a function or non-module object, return it directly
-    if not isinstance(raw_module, ModuleType):
-        return raw_module
-
-    # Handle circular references: Initialize visited set for the first call
-    if visited is None:
-        visited = set()
-
-    module_id = id(raw_module)
-    if module_id in visited:
-        return raw_module  # Return original for circular refs
-
-    visited.add(module_id)
+DANGEROUS_PATTERNS = (
+    "_os",
+    "os",
+    "subprocess",
+    "_subprocess",
+    "pty",
+    "system",
+    "popen",
+    "spawn",
+    "shutil",
+    "sys",
+    "pathlib",
+    "io",
+    "socket",
+    "compile",
+    "eval",
+    "exec",
+    "multiprocessing",
+)
+
+
+class SafeModule(ModuleType):
+    """
+    Safe view of a module, filled in attribute by attribute.
 
-    # Create new module for actual modules
-    safe_module = ModuleType(raw_module.__name__)
+    On first access an attribute is checked against the blocked patterns, submodules are wrapped in turn, and the
+    value is stored on the view so later accesses are plain attribute lookups. Views are shared by every interpreter
+    of the process, so they are read-only.
+    """
 
-    # Copy all attributes by reference, recursively checking modules
-    for attr_name in dir(raw_module):
+    def __getattr__(self, attr_name):
+        raw_module, blocked_patterns = _SAFE_MODULE_SOURCES[self]
         # Skip dangerous patterns at any level
-        if any(
-            pattern in raw_module.__name__.split(".") + [attr_name]
-            and not check_module_authorized(pattern, authorized_imports, dangerous_patterns)
-            for pattern in dangerous_patterns
-        ):
+        if blocked_patterns.intersection(raw_module.__name__.split(".")) or attr_name in blocked_patterns:
             logger.info(f"Skipping dangerous attribute {raw_module.__name__}.{attr_name}")
-            continue
-
+            raise AttributeError(f"module '{raw_module.__name__}' has no attribute '{attr_name}'")
         try:
             attr_value = getattr(raw_module, attr_name)
         except ImportError as e:
@@ -999,14 +1238,60 @@ def get_safe_module(raw_module, dangerous_patterns, authorized_imports, visited=
             logger.info(
                 f"Skipping import error while copying {raw_module.__name__}.{attr_name}: {type(e).__name__} - {e}"
             )
-            continue
-        # Recursively process nested modules, passing visited set
+            raise AttributeError(f"module '{raw_module.__name__}' has no attribute '{attr_name}'")
         if isinstance(attr_value, ModuleType):
-            attr_value = get_safe_module(attr_value, dangerous_patterns, authorized_imports, visited=visited)
+            attr_value = _wrap_module(attr_value, blocked_patterns)
+        ModuleType.__setattr__(self, attr_name, attr_value)
+        return attr_value
+
+    def __setattr__(self, attr_name, value):
+        raise InterpreterError(f"Cannot set attribute '{attr_name}' of module '{self.__name__}'")
+
+    def __delattr__(self, attr_name):
+        raise InterpreterError(f"Cannot delete attribute '{attr_name}' of module '{self.__name__}'")
+
+    def __dir__(self):
+        raw_module, blocked_patterns = _SAFE_MODULE_SOURCES[self]
+        if blocked_patterns.intersection(raw_module.__name__.split(".")):
+            return []
+        return [attr_name for attr_name in dir(raw_module) if attr_name not in blocked_patterns]
+
+
+# Wrapped module and blocked patterns of each SafeModule, kept off the view so the code cannot reach them
+_SAFE_MODULE_SOURCES: "WeakKeyDictionary[SafeModule, Tuple[ModuleType, frozenset]]" = WeakKeyDictionary()
+# Process-wide views keyed by (module name, blocked patterns)
+_SAFE_MODULES: Dict[Tuple[str, frozenset], SafeModule] = {}
+_SAFE_MODULES_LOCK = threading.Lock()
+
+
+def _wrap_module(raw_module: ModuleType, blocked_patterns: frozenset) -> SafeModule:
+    key = (raw_module.__name__, blocked_patterns)
+    with _SAFE_MODULES_LOCK:
+        safe_module = _SAFE_MODULES.get(key)
+        if safe_module is None or _SAFE_MODULE_SOURCES[safe_module][0] is not raw_module:
+            safe_module = SafeModule(raw_module.__name__, raw_module.__doc__)
+            _SAFE_MODULE_SOURCES[safe_module] = (raw_module, blocked_patterns)
+            _SAFE_MODULES[key] = safe_module
+    return safe_module
 
-        setattr(safe_module, attr_name, attr_value)
 
-    return safe_module
+@lru_cache(maxsize=None)
+def get_blocked_patterns(authorized_imports: frozenset, dangerous_patterns: tuple) -> frozenset:
+    """Dangerous patterns that the authorized imports don't allow."""
+    return frozenset(
+        pattern
+        for pattern in dangerous_patterns
+        if not check_module_authorized(pattern, authorized_imports, dangerous_patterns)
+    )
+
+
+def get_safe_module(raw_module, dangerous_patterns, authorized_imports):
+    """Returns the shared safe view of a module or the original if it's a function"""
+    # If it's a function or non-module object, return it directly
+    if not isinstance(raw_module, ModuleType):
+        return raw_module
+    blocked_patterns = get_blocked_patterns(frozenset(authorized_imports), tuple(dangerous_patterns))
+    return _wrap_module(raw_module, blocked_patterns)
 
 
 def check_module_authorized(module_name, authorized_imports, dangerous_patterns):
@@ -1022,25 +1307,7 @@ def check_module_authorized(module_name, authorized_imports, dangerous_patterns)
 
 
 def import_modules(expression, state, authorized_imports):
-    dangerous_patterns = (
-        "_os",
-        "os",
-        "subprocess",
-        "_subprocess",
-        "pty",
-        "system",
-        "popen",
-        "spawn",
-        "shutil",
-        "sys",
-        "pathlib",
-        "io",
-        "socket",
-        "compile",
-        "eval",
-        "exec",
-        "multiprocessing",
-    )
+    dangerous_patterns = DANGEROUS_PATTERNS
 
     if isinstance(expression, ast.Import):
         for alias in expression.names:
@@ -1085,10 +1352,10 @@ def evaluate_dictcomp(
     authorized_imports: List[str],
 ) -> Dict[Any, Any]:
     result = {}
+    new_state = Scope(state)
     for gen in dictcomp.generators:
         iter_value = evaluate_ast(gen.iter, state, static_tools, custom_tools, authorized_imports)
         for value in iter_value:
-            new_state = state.copy()
             set_value(
                 gen.target,
                 value,
@@ -1155,6 +1422,220 @@ def evaluate_delete(
             raise InterpreterError(f"Deletion of {type(target).__name__} targets is not supported")
 
 
+def evaluate_constant(expression: ast.Constant, *args) -> Any:
+    # Constant -> just return the value
+    return expression.value
+
+
+def evaluate_value(
+    expression: ast.AST,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> Any:
+    # Expression, starred, formatted value (part of f-string) -> evaluate the content
+    return evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
+
+
+def evaluate_tuple(
+    expression: ast.Tuple,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> tuple:
+    return tuple(evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts)
+
+
+def evaluate_list(
+    expression: ast.List,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> List[Any]:
+    return [evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts]
+
+
+def evaluate_set(
+    expression: ast.Set,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> set:
+    return {evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts}
+
+
+def evaluate_dict(
+    expression: ast.Dict,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> Dict[Any, Any]:
+    keys = [evaluate_ast(k, state, static_tools, custom_tools, authorized_imports) for k in expression.keys]
+    values = [evaluate_ast(v, state, static_tools, custom_tools, authorized_imports) for v in expression.values]
+    return dict(zip(keys, values))
+
+
+def evaluate_joinedstr(
+    expression: ast.JoinedStr,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> str:
+    return "".join(
+        [str(evaluate_ast(v, state, static_tools, custom_tools, authorized_imports)) for v in expression.values]
+    )
+
+
+def evaluate_ifexp(
+    expression: ast.IfExp,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> Any:
+    test_val = evaluate_ast(expression.test, state, static_tools, custom_tools, authorized_imports)
+    if test_val:
+        return evaluate_ast(expression.body, state, static_tools, custom_tools, authorized_imports)
+    else:
+        return evaluate_ast(expression.orelse, state, static_tools, custom_tools, authorized_imports)
+
+
+def evaluate_attribute(
+    expression: ast.Attribute,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> Any:
+    value = evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
+    return getattr(value, expression.attr)
+
+
+def evaluate_slice(
+    expression: ast.Slice,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> slice:
+    return slice(
+        evaluate_ast(expression.lower, state, static_tools, custom_tools, authorized_imports)
+        if expression.lower is not None
+        else None,
+        evaluate_ast(expression.upper, state, static_tools, custom_tools, authorized_imports)
+        if expression.upper is not None
+        else None,
+        evaluate_ast(expression.step, state, static_tools, custom_tools, authorized_imports)
+        if expression.step is not None
+        else None,
+    )
+
+
+def evaluate_return(
+    expression: ast.Return,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> None:
+    raise ReturnException(
+        evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
+        if expression.value
+        else None
+    )
+
+
+def evaluate_break(*args) -> None:
+    raise BreakException()
+
+
+def evaluate_continue(*args) -> None:
+    raise ContinueException()
+
+
+def evaluate_pass(*args) -> None:
+    return None
+
+
+def evaluate_import(
+    expression: ast.AST,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> None:
+    return import_modules(expression, state, authorized_imports)
+
+
+# Handler for each supported node type, looked up by exact type on every node visit
+EVALUATORS: Dict[type, Callable] = {
+    # Assignment -> we evaluate the assignment which should update the state
+    # We return the variable assigned as it may be used to determine the final result.
+    ast.Assign: evaluate_assign,
+    ast.AugAssign: evaluate_augassign,
+    # Function call -> we return the value of the function call
+    ast.Call: evaluate_call,
+    ast.Constant: evaluate_constant,
+    ast.Tuple: evaluate_tuple,
+    ast.ListComp: evaluate_listcomp,
+    ast.GeneratorExp: evaluate_listcomp,
+    ast.UnaryOp: evaluate_unaryop,
+    ast.Starred: evaluate_value,
+    ast.BoolOp: evaluate_boolop,
+    ast.Break: evaluate_break,
+    ast.Continue: evaluate_continue,
+    ast.BinOp: evaluate_binop,
+    ast.Compare: evaluate_condition,
+    ast.Lambda: evaluate_lambda,
+    ast.FunctionDef: evaluate_function_def,
+    ast.Dict: evaluate_dict,
+    ast.Expr: evaluate_value,
+    ast.For: evaluate_for,
+    ast.FormattedValue: evaluate_value,
+    ast.If: evaluate_if,
+    ast.JoinedStr: evaluate_joinedstr,
+    ast.List: evaluate_list,
+    # Name -> pick up the value in the state
+    ast.Name: evaluate_name,
+    # Subscript -> return the value of the indexing
+    ast.Subscript: evaluate_subscript,
+    ast.IfExp: evaluate_ifexp,
+    ast.Attribute: evaluate_attribute,
+    ast.Slice: evaluate_slice,
+    ast.DictComp: evaluate_dictcomp,
+    ast.While: evaluate_while,
+    ast.Import: evaluate_import,
+    ast.ImportFrom: evaluate_import,
+    ast.ClassDef: evaluate_class_def,
+    ast.Try: evaluate_try,
+    ast.Raise: evaluate_raise,
+    ast.Assert: evaluate_assert,
+    ast.With: evaluate_with,
+    ast.Set: evaluate_set,
+    ast.Return: evaluate_return,
+    ast.Pass: evaluate_pass,
+    ast.Delete: evaluate_delete,
+}
+if hasattr(ast, "Index"):
+    EVALUATORS[ast.Index] = evaluate_value
+
+
+def get_evaluator(node_type: type) -> Callable:
+    # Slow path for node types that are subclasses of a supported type, the result is added to the table
+    for base in node_type.__mro__[1:]:
+        if base in EVALUATORS:
+            EVALUATORS[node_type] = EVALUATORS[base]
+            return EVALUATORS[base]
+    # For now we refuse anything else. Let's add things as we need them.
+    raise InterpreterError(f"{node_type.__name__} is not supported.")
+
+
 def evaluate_ast(
     expression: ast.AST,
     state: Dict[str, Any],
@@ -1181,135 +1662,26 @@ def evaluate_ast(
         authorized_imports (`List[str]`):
             The list of modules that can be imported by the code. By default, only a few safe modules are allowed.
             If it contains "*", it will authorize any import. Use this at your own risk!
+
+    Evaluated nodes count against `MAX_OPERATIONS` for the `evaluate_python_code` run they are part of. Called
+    directly, outside of a run, the count covers this call only.
     """
-    if state.setdefault("_operations_count", 0) >= MAX_OPERATIONS:
+    operations = _operations.get()
+    if operations is None:
+        token = _operations.set(OperationCounter())
+        try:
+            return evaluate_ast(expression, state, static_tools, custom_tools, authorized_imports)
+        finally:
+            _operations.reset(token)
+    if operations.count >= MAX_OPERATIONS:
         raise InterpreterError(
             f"Reached the max number of operations of {MAX_OPERATIONS}. Maybe there is an infinite loop somewhere in the code, or you're just asking too many calculations."
         )
-    state["_operations_count"] += 1
-    if isinstance(expression, ast.Assign):
-        # Assignment -> we evaluate the assignment which should update the state
-        # We return the variable assigned as it may be used to determine the final result.
-        return evaluate_assign(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.AugAssign):
-        return evaluate_augassign(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Call):
-        # Function call -> we return the value of the function call
-        return evaluate_call(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Constant):
-        # Constant -> just return the value
-        return expression.value
-    elif isinstance(expression, ast.Tuple):
-        return tuple(
-            evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts
-        )
-    elif isinstance(expression, (ast.ListComp, ast.GeneratorExp)):
-        return evaluate_listcomp(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.UnaryOp):
-        return evaluate_unaryop(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Starred):
-        return evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.BoolOp):
-        # Boolean operation -> evaluate the operation
-        return evaluate_boolop(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Break):
-        raise BreakException()
-    elif isinstance(expression, ast.Continue):
-        raise ContinueException()
-    elif isinstance(expression, ast.BinOp):
-        # Binary operation -> execute operation
-        return evaluate_binop(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Compare):
-        # Comparison -> evaluate the comparison
-        return evaluate_condition(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Lambda):
-        return evaluate_lambda(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.FunctionDef):
-        return evaluate_function_def(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Dict):
-        # Dict -> evaluate all keys and values
-        keys = [evaluate_ast(k, state, static_tools, custom_tools, authorized_imports) for k in expression.keys]
-        values = [evaluate_ast(v, state, static_tools, custom_tools, authorized_imports) for v in expression.values]
-        return dict(zip(keys, values))
-    elif isinstance(expression, ast.Expr):
-        # Expression -> evaluate the content
-        return evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.For):
-        # For loop -> execute the loop
-        return evaluate_for(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.FormattedValue):
-        # Formatted value (part of f-string) -> evaluate the content and return
-        return evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.If):
-        # If -> execute the right branch
-        return evaluate_if(expression, state, static_tools, custom_tools, authorized_imports)
-    elif hasattr(ast, "Index") and isinstance(expression, ast.Index):
-        return evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.JoinedStr):
-        return "".join(
-            [str(evaluate_ast(v, state, static_tools, custom_tools, authorized_imports)) for v in expression.values]
-        )
-    elif isinstance(expression, ast.List):
-        # List -> evaluate all elements
-        return [evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts]
-    elif isinstance(expression, ast.Name):
-        # Name -> pick up the value in the state
-        return evaluate_name(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Subscript):
-        # Subscript -> return the value of the indexing
-        return evaluate_subscript(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.IfExp):
-        test_val = evaluate_ast(expression.test, state, static_tools, custom_tools, authorized_imports)
-        if test_val:
-            return evaluate_ast(expression.body, state, static_tools, custom_tools, authorized_imports)
-        else:
-            return evaluate_ast(expression.orelse, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Attribute):
-        value = evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-        return getattr(value, expression.attr)
-    elif isinstance(expression, ast.Slice):
-        return slice(
-            evaluate_ast(expression.lower, state, static_tools, custom_tools, authorized_imports)
-            if expression.lower is not None
-            else None,
-            evaluate_ast(expression.upper, state, static_tools, custom_tools, authorized_imports)
-            if expression.upper is not None
-            else None,
-            evaluate_ast(expression.step, state, static_tools, custom_tools, authorized_imports)
-            if expression.step is not None
-            else None,
-        )
-    elif isinstance(expression, ast.DictComp):
-        return evaluate_dictcomp(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.While):
-        return evaluate_while(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, (ast.Import, ast.ImportFrom)):
-        return import_modules(expression, state, authorized_imports)
-    elif isinstance(expression, ast.ClassDef):
-        return evaluate_class_def(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Try):
-        return evaluate_try(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Raise):
-        return evaluate_raise(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Assert):
-        return evaluate_assert(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.With):
-        return evaluate_with(expression, state, static_tools, custom_tools, authorized_imports)
-    elif isinstance(expression, ast.Set):
-        return {evaluate_ast(elt, state, static_tools, custom_tools, authorized_imports) for elt in expression.elts}
-    elif isinstance(expression, ast.Return):
-        raise ReturnException(
-            evaluate_ast(expression.value, state, static_tools, custom_tools, authorized_imports)
-            if expression.value
-            else None
-        )
-    elif isinstance(expression, ast.Pass):
-        return None
-    elif isinstance(expression, ast.Delete):
-        return evaluate_delete(expression, state, static_tools, custom_tools, authorized_imports)
-    else:
-        # For now we refuse anything else. Let's add things as we need them.
-        raise InterpreterError(f"{expression.__class__.__name__} is not supported.")
+    operations.count += 1
+    evaluator = EVALUATORS.get(type(expression))
+    if evaluator is None:
+        evaluator = get_evaluator(type(expression))
+    return evaluator(expression, state, static_tools, custom_tools, authorized_imports)
 
 
 class FinalAnswerException(BaseException):
@@ -1317,6 +1689,69 @@ class FinalAnswerException(BaseException):
         self.value = value
 
 
+class ParsedCode:
+    """A parsed code action, with the source of its top-level statements as shown in error messages."""
+
+    __slots__ = ("code", "module", "segments")
+
+    def __init__(self, code: str):
+        self.code = code
+        self.module = ast.parse(code)
+        self.segments = {}
+
+    def segment(self, index: int) -> Optional[str]:
+        # get_source_segment splits the whole code, so it is only done for the statements that fail
+        if index not in self.segments:
+            self.segments[index] = ast.get_source_segment(self.code, self.module.body[index])
+        return self.segments[index]
+
+
+class ParseCache:
+    """
+    LRU cache of parsed code actions keyed by the hash of their source.
+
+    Agents retrying a snippet and re-runs of the same tests evaluate identical code, which is then parsed only once.
+    Code with a syntax error is not cached.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_PARSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, ParsedCode] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def parse(self, code: str) -> ParsedCode:
+        key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+        parsed = ParsedCode(code)
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[key] = parsed
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return parsed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Used by evaluate_python_code when no cache is given
+PARSE_CACHE = ParseCache()
+
+
 def evaluate_python_code(
     code: str,
     static_tools: Optional[Dict[str, Callable]] = None,
@@ -1324,6 +1759,8 @@ def evaluate_python_code(
     state: Optional[Dict[str, Any]] = None,
     authorized_imports: List[str] = BASE_BUILTIN_MODULES,
     max_print_outputs_length: int = DEFAULT_MAX_LEN_OUTPUT,
+    operations: Optional[OperationCounter] = None,
+    parse_cache: Optional[ParseCache] = None,
 ):
     """
     Evaluate a python expression using the content of the variables stored in a state and only evaluating a given set
@@ -1344,9 +1781,15 @@ def evaluate_python_code(
             A dictionary mapping variable names to values. The `state` should contain the initial inputs but will be
             updated by this function to contain all variables as they are evaluated.
             The print outputs will be stored in the state under the key "_print_outputs".
+        operations (`OperationCounter`, *optional*):
+            Counts the AST nodes evaluated for this code, a new counter is used if not given.
+        parse_cache (`ParseCache`, *optional*):
+            Cache of parsed code, defaults to the process-wide `PARSE_CACHE`.
     """
+    if parse_cache is None:
+        parse_cache = PARSE_CACHE
     try:
-        expression = ast.parse(code)
+        parsed = parse_cache.parse(code)
     except SyntaxError as e:
         raise InterpreterError(
             f"Code parsing failed on line {e.lineno} due to: {type(e).__name__}\n"
@@ -1360,32 +1803,26 @@ def evaluate_python_code(
     static_tools = static_tools.copy() if static_tools is not None else {}
     custom_tools = custom_tools if custom_tools is not None else {}
     result = None
-    state["_print_outputs"] = PrintContainer()
+    state["_print_outputs"] = PrintContainer(max_print_outputs_length)
 
     def final_answer(value):
         raise FinalAnswerException(value)
 
+    operations_token = _operations.set(operations if operations is not None else OperationCounter())
     try:
-        for node in expression.body:
+        for index, node in enumerate(parsed.module.body):
             result = evaluate_ast(node, state, static_tools, custom_tools, authorized_imports)
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
         is_final_answer = False
         return result, is_final_answer
     except FinalAnswerException as e:
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
         is_final_answer = True
         return e.value, is_final_answer
     except Exception as e:
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
         raise InterpreterError(
-            f"Code execution failed at line '{ast.get_source_segment(code, node)}' due to: {type(e).__name__}: {e}"
+            f"Code execution failed at line '{parsed.segment(index)}' due to: {type(e).__name__}: {e}"
         )
+    finally:
+        _operations.reset(operations_token)
 
 
 class LocalPythonInterpreter:
@@ -1394,35 +1831,120 @@ class LocalPythonInterpreter:
         additional_authorized_imports: List[str],
         tools: Dict,
         max_print_outputs_length: Optional[int] = None,
+        parse_cache_size: int = DEFAULT_PARSE_CACHE_SIZE,
+        trace_filter: Union[str, Iterable[str]] = "all",
+        max_trace_entries: int = DEFAULT_MAX_TRACE_ENTRIES,
+        max_trace_repr_length: Optional[int] = None,
     ):
         self.custom_tools = {}
         self.state = {}
+        self.operations_count = 0
+        self.parse_cache = ParseCache(parse_cache_size)
         self.max_print_outputs_length = max_print_outputs_length
         if max_print_outputs_length is None:
             self.max_print_outputs_length = DEFAULT_MAX_LEN_OUTPUT
         self.additional_authorized_imports = additional_authorized_imports
-        self.authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
+        self.authorized_imports = sorted(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
         # Add base trusted tools to list
         self.static_tools = {
             **tools,
             **BASE_PYTHON_TOOLS.copy(),
         }
+        # "all", "tools" for the tools given to the interpreter, or the names of the functions to trace
+        if trace_filter == "all":
+            self.trace_names = None
+        elif trace_filter == "tools":
+            self.trace_names = set(tools)
+        else:
+            self.trace_names = set(trace_filter)
+        self.max_trace_entries = max_trace_entries
+        self.max_trace_repr_length = max_trace_repr_length
         # TODO: assert self.authorized imports are all installed locally
 
     def __call__(self, code_action: str, additional_variables: Dict) -> Tuple[Any, str, bool]:
-        self.state['_trace'] = []
-        self.state.update(additional_variables)
+        operations = OperationCounter()
+        try:
+            return self._evaluate(code_action, additional_variables, self.state, self.custom_tools, operations)
+        finally:
+            self.operations_count = operations.count
+
+    def _evaluate(
+        self,
+        code_action: str,
+        additional_variables: Dict,
+        state: Dict[str, Any],
+        custom_tools: Dict[str, Callable],
+        operations: OperationCounter,
+    ) -> Tuple[Any, str, bool]:
+        trace = TraceRecorder(self.trace_names, self.max_trace_entries, self.max_trace_repr_length)
+        state["_trace"] = trace
+        state.update(additional_variables)
         output, is_final_answer = evaluate_python_code(
             code_action,
             static_tools=self.static_tools,
-            custom_tools=self.custom_tools,
-            state=self.state,
+            custom_tools=custom_tools,
+            state=state,
             authorized_imports=self.authorized_imports,
             max_print_outputs_length=self.max_print_outputs_length,
+            operations=operations,
+            parse_cache=self.parse_cache,
         )
-        logs = str(self.state["_print_outputs"])
-        trace = self.state['_trace']
+        logs = str(state["_print_outputs"])
         return output, logs, is_final_answer, trace
 
+    def fork(self) -> "InterpreterFork":
+        """Returns an interpreter that runs code on a copy-on-write view of this state, kept only on `commit`."""
+        return InterpreterFork(self)
+
+    def commit(self, forked: "InterpreterFork"):
+        """Applies the names assigned and deleted by `forked`, returned by `fork`, to the state of this interpreter."""
+        # Updated in place: functions defined by earlier code actions look their globals up in these dicts
+        for name in forked.state.deleted:
+            self.state.pop(name, None)
+        self.state.update(dict.items(forked.state))
+        forked.state.committed = True
+        self.custom_tools.update(forked.custom_tools)
+        self.operations_count = forked.operations_count
+
+    @property
+    def parse_cache_hits(self) -> int:
+        return self.parse_cache.hits
+
+    @property
+    def parse_cache_misses(self) -> int:
+        return self.parse_cache.misses
+
 
-__all__ = ["evaluate_python_code", "LocalPythonInterpreter"]
+class InterpreterFork:
+    """
+    Runs code actions on a `ForkState` over the state of a `LocalPythonInterpreter`, which is left unchanged.
+
+    Only the names the fork reads are copied. Functions defined by earlier code actions run on the fork state when
+    the fork calls them. Tools are the real ones, so their side effects are not undone for a fork that is discarded.
+    """
+
+    def __init__(self, parent: LocalPythonInterpreter):
+        self.parent = parent
+        self.state = ForkState(parent.state)
+        self.custom_tools = dict(parent.custom_tools)
+        self.operations_count = parent.operations_count
+
+    def __call__(self, code_action: str, additional_variables: Dict) -> Tuple[Any, str, bool]:
+        operations = OperationCounter()
+        token = _active_fork.set(self.state)
+        try:
+            return self.parent._evaluate(code_action, additional_variables, self.state, self.custom_tools, operations)
+        finally:
+            _active_fork.reset(token)
+            self.operations_count = operations.count
+
+
+__all__ = [
+    "evaluate_python_code",
+    "LocalPythonInterpreter",
+    "InterpreterFork",
+    "ForkState",
+    "ParseCache",
+    "TraceCall",
+    "TraceRecorder",
+]
@@ -1,4 +1,7 @@
+from collections.abc import Sequence
+from copy import deepcopy
 from dataclasses import asdict, dataclass
+from itertools import islice
 from logging import getLogger
 from typing import TYPE_CHECKING, Any, Dict, List, TypedDict, Union
 
@@ -60,12 +63,13 @@ class ActionStep(MemoryStep):
     observations: str | None = None
     observations_images: List[str] | None = None
     action_output: Any = None
-    trace: List[Any] | None = None
+    trace: Any = None
+    context_tokens: int | None = None
 
     def dict(self):
         # We overwrite the method to parse the tool_calls and action_output manually
         return {
-            "model_input_messages": self.model_input_messages,
+            "model_input_messages": list(self.model_input_messages) if self.model_input_messages is not None else None,
             "tool_calls": [tc.dict() for tc in self.tool_calls] if self.tool_calls else [],
             "start_time": self.start_time,
             "end_time": self.end_time,
@@ -76,6 +80,7 @@ class ActionStep(MemoryStep):
             "model_output": self.model_output,
             "observations": self.observations,
             "action_output": make_json_serializable(self.action_output),
+            "context_tokens": self.context_tokens,
         }
 
     def to_messages(self, summary_mode: bool = False, show_model_input_messages: bool = False) -> List[Message]:
@@ -190,14 +195,114 @@ class SystemPromptStep(MemoryStep):
         return [Message(role=MessageRole.SYSTEM, content=[{"type": "text", "text": self.system_prompt.strip()}])]
 
 
+class MessageView(Sequence):
+    """Read-only view of the first `length` messages of a shared append-only message list.
+
+    Views are cheap to create and safe to keep: the underlying list is only ever appended to, so every step can
+    hold the messages it was prompted with without copying the conversation.
+    """
+
+    __slots__ = ("_messages", "_length")
+
+    def __init__(self, messages: List[Message], length: int | None = None):
+        self._messages = messages
+        self._length = len(messages) if length is None else length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._messages[: self._length][index]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("message index out of range")
+        return self._messages[index]
+
+    def __iter__(self):
+        return islice(self._messages, self._length)
+
+    def __add__(self, other) -> List[Message]:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> List[Message]:
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MessageView, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __deepcopy__(self, memo) -> List[Message]:
+        return deepcopy(list(self), memo)
+
+    def __repr__(self) -> str:
+        return f"MessageView({list(self)!r})"
+
+    def copy(self) -> "MessageView":
+        # The view is immutable so sharing it is as good as a copy
+        return self
+
+
+class MessageLog:
+    """Append-only log of the messages rendered from a memory, each step being rendered only once."""
+
+    def __init__(self, system_prompt: SystemPromptStep, summary_mode: bool = False):
+        self.system_prompt = system_prompt
+        self.summary_mode = summary_mode
+        self.messages: List[Message] = list(system_prompt.to_messages(summary_mode=summary_mode))
+        self.steps: List[MemoryStep] = []
+        self.offsets: List[int] = []
+        self.token_counts: List[int] = []
+
+    def follows(self, system_prompt: SystemPromptStep, steps: List[MemoryStep]) -> bool:
+        """Whether `steps` only appends to the steps already rendered in this log."""
+        if system_prompt is not self.system_prompt or len(steps) < len(self.steps):
+            return False
+        return not self.steps or steps[len(self.steps) - 1] is self.steps[-1]
+
+    def sync(self, steps: List[MemoryStep]):
+        for step in steps[len(self.steps):]:
+            self.offsets.append(len(self.messages))
+            self.messages.extend(step.to_messages(summary_mode=self.summary_mode))
+            self.steps.append(step)
+
+    def system_messages(self) -> List[Message]:
+        return self.messages[: self.offsets[0]] if self.offsets else list(self.messages)
+
+    def step_messages(self, index: int) -> List[Message]:
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else len(self.messages)
+        return self.messages[self.offsets[index]:end]
+
+    def view(self) -> MessageView:
+        return MessageView(self.messages)
+
+
 class AgentMemory:
     def __init__(self, system_prompt: str):
         self.system_prompt = SystemPromptStep(system_prompt=system_prompt)
         self.steps: List[Union[TaskStep, ActionStep, PlanningStep]] = []
+        self._message_logs: Dict[bool, MessageLog] = {}
 
     def reset(self):
         self.steps = []
 
+    def message_log(self, summary_mode: bool = False) -> MessageLog:
+        """Returns the message log for the current steps, rendering only the steps added since the last call.
+
+        The log is rebuilt from scratch if the system prompt was replaced or the steps were reset.
+        """
+        log = self._message_logs.get(summary_mode)
+        if log is None or not log.follows(self.system_prompt, self.steps):
+            log = MessageLog(self.system_prompt, summary_mode=summary_mode)
+            self._message_logs[summary_mode] = log
+        log.sync(self.steps)
+        return log
+
+    def write_to_messages(self, summary_mode: bool = False) -> MessageView:
+        return self.message_log(summary_mode=summary_mode).view()
+
     def get_succinct_steps(self) -> list[dict]:
         return [
             {key: value for key, value in step.dict().items() if key != "model_input_messages"} for step in self.steps
@@ -232,4 +337,4 @@ class AgentMemory:
                 logger.log_markdown(title="Agent output:", content=step.facts + "\n" + step.plan)
 
 
-__all__ = ["AgentMemory"]
+__all__ = ["AgentMemory", "MessageLog", "MessageView"]
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import threading
+from typing import Any, Dict, Generator, List, Optional
+
+from smolagents import LiteLLMModel as BaseLiteLLMModel
+from smolagents.models import ChatMessage, parse_tool_args_if_needed
+
+
+class LiteLLMModel(BaseLiteLLMModel):
+    """
+    smolagents.LiteLLMModel with an awaitable `acall` that goes through `litellm.acompletion`.
+
+    The synchronous `__call__` is unchanged, so this can be used anywhere the base class is used.
+    """
+
+    def _completion_kwargs(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List] = None,
+        **kwargs,
+    ) -> Dict:
+        return self._prepare_completion_kwargs(
+            messages=messages,
+            stop_sequences=stop_sequences,
+            grammar=grammar,
+            tools_to_call_from=tools_to_call_from,
+            model=self.model_id,
+            api_base=self.api_base,
+            api_key=self.api_key,
+            convert_images_to_image_urls=True,
+            flatten_messages_as_text=self.model_id.startswith("ollama"),
+            custom_role_conversions=self.custom_role_conversions,
+            **kwargs,
+        )
+
+    def _chat_message(self, response, tools_to_call_from: Optional[List] = None) -> ChatMessage:
+        self.last_input_token_count = response.usage.prompt_tokens
+        self.last_output_token_count = response.usage.completion_tokens
+
+        message = ChatMessage.from_dict(
+            response.choices[0].message.model_dump(include={"role", "content", "tool_calls"})
+        )
+        message.raw = response
+
+        if tools_to_call_from is not None:
+            return parse_tool_args_if_needed(message)
+        return message
+
+    async def acall(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        tools_to_call_from: Optional[List] = None,
+        **kwargs,
+    ) -> ChatMessage:
+        import litellm
+
+        completion_kwargs = self._completion_kwargs(
+            messages,
+            stop_sequences=stop_sequences,
+            grammar=grammar,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        response = await litellm.acompletion(**completion_kwargs)
+        return self._chat_message(response, tools_to_call_from)
+
+    def stream(
+        self,
+        messages: List[Dict[str, str]],
+        stop_sequences: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        **kwargs,
+    ) -> Generator[str, None, None]:
+        """Yields the text of the completion as it is generated. Closing the generator closes the response."""
+        import litellm
+
+        completion_kwargs = self._completion_kwargs(
+            messages,
+            stop_sequences=stop_sequences,
+            grammar=grammar,
+            **kwargs,
+        )
+        self.last_input_token_count = 0
+        self.last_output_token_count = 0
+        response = litellm.completion(**completion_kwargs, stream=True)
+        try:
+            for chunk in response:
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    self.last_input_token_count = usage.prompt_tokens
+                    self.last_output_token_count = usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+
+
+async def acall_model(model, messages, **kwargs) -> ChatMessage:
+    """Awaits `model.acall` when the model has one, otherwise runs the blocking call in a worker thread."""
+    if hasattr(model, "acall"):
+        return await model.acall(messages, **kwargs)
+    return await asyncio.to_thread(model, messages, **kwargs)
+
+
+class StopSequenceDetector:
+    """
+    Finds the first stop sequence in a streamed model output, as the model server would for a whole completion.
+
+    Only the text received since the previous `feed` is searched. `text` is the output up to the stop sequence.
+    """
+
+    def __init__(self, stop_sequences: Optional[List[str]] = None):
+        self.stop_sequences = [stop for stop in stop_sequences or () if stop]
+        self.text = ""
+        self._overlap = max((len(stop) for stop in self.stop_sequences), default=1) - 1
+
+    def feed(self, delta: str) -> bool:
+        # A stop sequence may be split between two deltas
+        start = max(0, len(self.text) - self._overlap)
+        self.text += delta
+        found = [index for index in (self.text.find(stop, start) for stop in self.stop_sequences) if index >= 0]
+        if not found:
+            return False
+        self.text = self.text[:min(found)]
+        return True
+
+    @property
+    def settled(self) -> str:
+        """The text that can no longer turn out to be part of a stop sequence."""
+        return self.text[:max(0, len(self.text) - self._overlap)]
+
+
+CACHE_MODES = ("readwrite", "record", "replay")
+
+# Token counts change on every call, and credentials must not end up in the cache
+_UNKEYED_SETTINGS = ("last_input_token_count", "last_output_token_count", "api_key", "token")
+
+
+class ResponseCacheMiss(Exception):
+    """Raised in replay mode for a request that is not in the cache."""
+
+
+def _model_settings(model) -> Dict[str, Any]:
+    """Settings of `model` that change its responses, like `api_base` or the sampling arguments, from `to_dict`."""
+    to_dict = getattr(model, "to_dict", None)
+    if to_dict is None:
+        return {}
+    return {name: value for name, value in to_dict().items() if name not in _UNKEYED_SETTINGS}
+
+
+class CachingModel:
+    """
+    Wraps a model to serve repeated requests from a `ResponseCache`.
+
+    Modes:
+        - "readwrite": serves hits from the cache and stores the responses of misses.
+        - "record": always calls the model and stores the response, replacing the cached one.
+        - "replay": only serves from the cache, ignoring `max_age`, and raises `ResponseCacheMiss` on a miss.
+
+    Requests are keyed on the settings of the wrapped model too, read once here, so the same model id behind another
+    server or with other sampling arguments does not share responses. Everything else, like `model_id` or `to_dict`,
+    is delegated to the wrapped model.
+    """
+
+    def __init__(self, model, cache, mode: str = "readwrite"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {', '.join(CACHE_MODES)}")
+        self.model = model
+        self.cache = cache
+        self.mode = mode
+        self.settings = _model_settings(model)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_input_token_count = 0
+        self.last_output_token_count = 0
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _key(self, messages, stop_sequences=None, **kwargs):
+        from .response_cache import request_key
+
+        return request_key(
+            getattr(self.model, "model_id", None), messages, stop_sequences, model_settings=self.settings, **kwargs
+        )
+
+    def _lookup(self, key):
+        if self.mode == "record":
+            return None
+        cached = self.cache.get(key, max_age=None if self.mode == "replay" else self.cache.max_age)
+        if cached is None:
+            if self.mode == "replay":
+                raise ResponseCacheMiss(f"No cached response for request {key} in {self.cache.path}")
+            return None
+        response, self.last_input_token_count, self.last_output_token_count = cached
+        with self._lock:
+            self.hits += 1
+        return ChatMessage.from_dict(json.loads(response))
+
+    def _store(self, key, message: ChatMessage) -> ChatMessage:
+        with self._lock:
+            self.misses += 1
+        self.last_input_token_count = getattr(self.model, "last_input_token_count", 0)
+        self.last_output_token_count = getattr(self.model, "last_output_token_count", 0)
+        self.cache.put(
+            key,
+            message.model_dump_json(),
+            model_id=getattr(self.model, "model_id", None),
+            input_tokens=self.last_input_token_count,
+            output_tokens=self.last_output_token_count,
+        )
+        return message
+
+    def __call__(self, messages: List[Dict[str, str]], stop_sequences: Optional[List[str]] = None, **kwargs) -> ChatMessage:
+        messages = list(messages)
+        key = self._key(messages, stop_sequences, **kwargs)
+        message = self._lookup(key)
+        if message is None:
+            message = self._store(key, self.model(messages, stop_sequences=stop_sequences, **kwargs))
+        return message
+
+    def stream(self, messages: List[Dict[str, str]], stop_sequences: Optional[List[str]] = None, **kwargs) -> Generator[str, None, None]:
+        """
+        Yields a cached response in one piece, or streams the wrapped model and stores the completion.
+
+        The stream ends at the first stop sequence, like a whole completion would, and the text before it is stored.
+        Otherwise the text is only stored once the wrapped stream is exhausted: a stream closed early by the consumer,
+        for instance after an error, is not complete.
+        """
+        messages = list(messages)
+        key = self._key(messages, stop_sequences, **kwargs)
+        message = self._lookup(key)
+        if message is not None:
+            yield message.content
+            return
+        end = StopSequenceDetector(stop_sequences)
+        sent = 0
+        stream = self.model.stream(messages, stop_sequences=stop_sequences, **kwargs)
+        try:
+            for chunk in stream:
+                if end.feed(chunk):
+                    break
+                if len(end.settled) > sent:
+                    yield end.settled[sent:]
+                    sent = len(end.settled)
+            if len(end.text) > sent:
+                yield end.text[sent:]
+        finally:
+            stream.close()
+        self._store(key, ChatMessage(role="assistant", content=end.text))
+
+    async def acall(self, messages: List[Dict[str, str]], stop_sequences: Optional[List[str]] = None, **kwargs) -> ChatMessage:
+        messages = list(messages)
+        key = self._key(messages, stop_sequences, **kwargs)
+        message = self._lookup(key)
+        if message is None:
+            message = self._store(key, await acall_model(self.model, messages, stop_sequences=stop_sequences, **kwargs))
+        return message
+
+
+__all__ = ["LiteLLMModel", "acall_model", "CachingModel", "ResponseCacheMiss", "CACHE_MODES", "StopSequenceDetector"]
@@ -0,0 +1,161 @@
+"""
+SQLite cache of model responses, keyed by the request sent to the model.
+
+A request is content-addressed by the model id, the messages, the stop sequences and the other generation arguments,
+so re-running test generation on an unchanged module serves every step from the cache instead of the model.
+
+The cache lives in $FTL_PYTEST_AGENT_RESPONSE_CACHE, by default ~/.cache/ftl-pytest-agent/responses.sqlite. Entries
+older than `max_age` seconds are not served, and the least recently used entries are evicted once the responses
+take more than `max_size` bytes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the key or the stored format changes, so entries written by older versions are not used
+CACHE_VERSION = 2
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model_id TEXT,
+    response TEXT NOT NULL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+)
+"""
+
+
+def default_path() -> str:
+    path = os.environ.get("FTL_PYTEST_AGENT_RESPONSE_CACHE")
+    if path:
+        return path
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "ftl-pytest-agent", "responses.sqlite")
+
+
+def _json_default(value):
+    # Set order depends on the hash seed of the process
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    # Tools passed as tools_to_call_from and images in messages have no JSON form
+    name = getattr(value, "name", None)
+    if isinstance(name, str):
+        return name
+    return repr(value)
+
+
+def request_key(
+    model_id: Optional[str],
+    messages: List[Dict],
+    stop_sequences: Optional[List[str]] = None,
+    model_settings: Optional[Dict] = None,
+    **kwargs,
+) -> str:
+    """Cache key of a model call. `model_settings` are the arguments the model was created with, like `api_base`."""
+    request = {
+        "version": CACHE_VERSION,
+        "model_id": model_id,
+        "model_settings": model_settings or {},
+        "messages": list(messages),
+        "stop_sequences": stop_sequences,
+        "kwargs": kwargs,
+    }
+    text = json.dumps(request, sort_keys=True, default=_json_default)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Model responses stored in a SQLite database, safe to share between threads and processes.
+
+    Args:
+        path (`str`, *optional*): Database file, defaults to `default_path()`. ":memory:" keeps the cache in memory.
+        max_size (`int`): Total size in bytes of the stored responses above which the least recently used are evicted.
+        max_age (`float`, *optional*): Seconds after which an entry is no longer served. None keeps entries forever.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE, max_age: Optional[float] = DEFAULT_MAX_AGE):
+        self.path = path or default_path()
+        self.max_size = max_size
+        self.max_age = max_age
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            if self.path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(_SCHEMA)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[str, int, int]]:
+        """Returns (response, input tokens, output tokens) of `key`, None if it is missing or older than `max_age`."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, input_tokens, output_tokens, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, input_tokens, output_tokens, created = row
+            now = time.time()
+            if max_age is not None and now - created > max_age:
+                return None
+            self._connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        return response, input_tokens, output_tokens
+
+    def put(self, key: str, response: str, model_id: Optional[str] = None, input_tokens: int = 0, output_tokens: int = 0):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model_id, response, input_tokens, output_tokens, len(response.encode()), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.max_age is not None:
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        (total,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_size:
+            return
+        # Drop the least recently used entries until the rest fits
+        excess = total - self.max_size
+        keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY used"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        logger.debug(f"Evicted {len(keys)} responses from {self.path}")
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+__all__ = ["ResponseCache", "request_key", "default_path"]
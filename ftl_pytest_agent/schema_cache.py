@@ -0,0 +1,152 @@
+"""
+On-disk cache of the JSON schemas generated from tool functions.
+
+Generating a schema parses the docstring and the type hints of the function. The result is stored under a key made of
+the qualified name of the function, a hash of the file that defines it and its type hints, with a hash of the files
+defining the classes they use. Editing the file, or a type imported from another module, invalidates the schemas of
+its functions, and warm runs skip the parsing entirely.
+
+The cache lives in $FTL_PYTEST_AGENT_SCHEMA_CACHE, by default ~/.cache/ftl-pytest-agent/schemas. Setting the variable
+to an empty string keeps the cache in memory only.
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import typing
+from typing import Any, Callable, List, Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the schema generation changes, so schemas written by older versions are not used
+SCHEMA_VERSION = 1
+
+# Schemas as JSON text, a copy is decoded for every caller
+_schemas = {}
+# sha256 of each source file, by path, with the (mtime_ns, size) it was computed for
+_file_digests = {}
+_lock = threading.Lock()
+
+
+def cache_dir() -> Optional[str]:
+    directory = os.environ.get("FTL_PYTEST_AGENT_SCHEMA_CACHE")
+    if directory is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        directory = os.path.join(cache_home, "ftl-pytest-agent", "schemas")
+    return directory or None
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _file_digests.get(path)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with _lock:
+        _file_digests[path] = ((stat.st_mtime_ns, stat.st_size), digest)
+    return digest
+
+
+def _hint_files(hint: Any, files: Set[str]):
+    """Adds the source files of the classes used in the type hint `hint` to `files`."""
+    if isinstance(hint, (list, tuple)):
+        # The parameters of Callable[[...], ...]
+        for item in hint:
+            _hint_files(item, files)
+        return
+    if isinstance(hint, type):
+        path = getattr(sys.modules.get(hint.__module__), "__file__", None)
+        if path is not None:
+            files.add(path)
+    for arg in typing.get_args(hint):
+        _hint_files(arg, files)
+
+
+def _hint_parts(func: Callable) -> List[str]:
+    """Type hints of `func` and the digests of the files defining the classes they use, both can change its schema."""
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        # Hints that cannot be resolved are used as written
+        hints = dict(getattr(func, "__annotations__", None) or {})
+    files = set()
+    for hint in hints.values():
+        _hint_files(hint, files)
+    files.discard(func.__code__.co_filename)
+    return [repr(sorted(hints.items()))] + [f"{path}:{_file_digest(path)}" for path in sorted(files)]
+
+
+def schema_key(kind: str, func: Callable) -> Optional[str]:
+    """Cache key of the `kind` schema of `func`, or None for functions that are not defined in a source file."""
+    # A functools.wraps decorator gives the wrapper's code, the schema comes from the wrapped function
+    unwrapped = inspect.unwrap(func)
+    code = getattr(unwrapped, "__code__", None)
+    if code is None:
+        return None
+    digest = _file_digest(code.co_filename)
+    if digest is None:
+        return None
+    # tool() replaces the signature of the function it wraps, which changes the schema
+    signature = getattr(func, "__signature__", None)
+    parts = [
+        str(SCHEMA_VERSION),
+        kind,
+        f"{func.__module__}.{func.__qualname__}",
+        str(code.co_firstlineno),
+        digest,
+        str(signature) if signature is not None else "",
+        *_hint_parts(unwrapped),
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def cached_schema(kind: str, func: Callable, generate: Callable[[], Any]) -> Any:
+    """Returns the `kind` schema of `func` from the cache, calling `generate` on a miss. Errors are not cached."""
+    key = schema_key(kind, func)
+    if key is None:
+        return generate()
+
+    with _lock:
+        text = _schemas.get(key)
+    if text is None:
+        directory = cache_dir()
+        path = os.path.join(directory, key[:2], f"{key}.json") if directory else None
+        if path is not None:
+            try:
+                with open(path) as f:
+                    text = f.read()
+            except OSError:
+                pass
+        if text is None:
+            text = json.dumps(generate())
+            if path is not None:
+                _write(path, text)
+        with _lock:
+            _schemas[key] = text
+    return json.loads(text)
+
+
+def _write(path: str, text: str):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first so concurrent runs never read a partial schema
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.debug(f"Cannot write schema cache {path}: {e}")
+
+
+__all__ = ["cached_schema", "cache_dir"]
@@ -1,9 +1,11 @@
 
 import os
-from ftl_pytest_agent.core import create_model, run_agent
+from ftl_pytest_agent.core import create_context_budget, create_model, run_agent
 from ftl_pytest_agent.default_tools import TOOLS
-from ftl_pytest_agent.tools import get_tool, load_code
+from ftl_pytest_agent.tools import get_tool
+from ftl_pytest_agent.util import get_functions, get_functions_static, load_module
 from ftl_pytest_agent.codegen import (
+    TestFileWriter,
     generate_python_header,
     reformat_python,
     generate_python_tool_call,
@@ -14,38 +16,116 @@ from ftl_pytest_agent.memory import ActionStep
 from smolagents.agent_types import AgentText
 
 
-def generate_test(model, code_file, tools, prompt, output, explain, llm_api_base):
+class TestGenSession:
+    """
+    Loads a code file, its tools and the model once and then serves many generate calls.
+
+    The module under test is executed a single time; the same function objects are used for
+    the tool classes and for the import header of every generated test. With `static` the
+    functions are listed from the source and the module is only executed by the first generate.
+    With `warm_workers` the code actions run in an `InterpreterPool` that keeps that many forked
+    workers ready, the session should then be closed. Candidates need the interpreter in this
+    process, so `num_candidates` cannot be combined with `warm_workers`.
+    """
 
-    code_files = [code_file]
-
-    tool_classes = {}
-    tool_classes.update(TOOLS)
-    for cf in code_files:
-        tool_classes.update(load_code(cf))
-    model = create_model(model, llm_api_base=llm_api_base or os.environ.get('LLM_API_BASE'))
-    state = {
-    }
-
-    generate_python_header(
-        output,
-        prompt,
-        [],
-        code_files,
-        tools,
-    )
-    generate_explain_header(explain, prompt)
-
-    for o in run_agent(
-        tools=[get_tool(tool_classes, t, state) for t in tools],
-        model=model,
-        problem_statement=prompt,
+    def __init__(
+        self,
+        model,
+        code_file,
+        llm_api_base=None,
+        context=8192,
+        context_policy=None,
+        static=False,
+        cache_mode=None,
+        cache_path=None,
+        num_candidates=1,
+        warm_workers=0,
     ):
-        if isinstance(o, ActionStep):
-            generate_explain_action_step(explain, o)
-            if o.trace and o.tool_calls:
-                for call in o.tool_calls:
-                    generate_python_tool_call(output, call)
-        elif isinstance(o, AgentText):
-            print(o.to_string())
-
-    reformat_python(output)
+        if num_candidates > 1 and warm_workers:
+            raise ValueError("num_candidates > 1 needs the interpreter in this process, not warm_workers")
+        self.code_file = code_file
+        if static:
+            self.module, self.fns = get_functions_static(code_file)
+        else:
+            self.module, self.fns = get_functions(code_file)
+        self.model = create_model(
+            model,
+            context=context,
+            llm_api_base=llm_api_base or os.environ.get('LLM_API_BASE'),
+            cache_mode=cache_mode,
+            cache_path=cache_path,
+        )
+        self.context = context
+        self.context_policy = context_policy
+        self.num_candidates = num_candidates
+        self.pool = None
+        if warm_workers:
+            from ftl_pytest_agent.interpreter_pool import InterpreterPool
+
+            self.pool = InterpreterPool(code_files=[code_file], size=warm_workers)
+
+    def verify(self, outputs, workers=None):
+        """Runs the generated test files with pytest and returns their `FileResult`s by path."""
+        from ftl_pytest_agent.verify import verify_tests, verify_tests_in_fork
+
+        import_paths = [os.path.dirname(os.path.abspath(self.code_file))]
+        if self.pool is not None:
+            # In a fork the imported test modules and the module under test are thrown away afterwards
+            return self.pool.server.call(verify_tests_in_fork, outputs, import_paths, workers)
+        return verify_tests(outputs, import_paths=import_paths, workers=workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    @property
+    def tool_classes(self):
+        tool_classes = {}
+        tool_classes.update(TOOLS)
+        tool_classes.update(load_module(self.code_file).tools)
+        return tool_classes
+
+    def generate(self, tools, prompt, output, explain):
+
+        state = {
+        }
+        info = load_module(self.code_file)
+        tool_classes = self.tool_classes
+
+        with TestFileWriter(output) as python, TestFileWriter(explain) as explanation:
+            generate_python_header(
+                python,
+                prompt,
+                [],
+                [self.code_file],
+                tools,
+                modules=[(info.module, info.fns)],
+            )
+            generate_explain_header(explanation, prompt)
+
+            for o in run_agent(
+                tools=[get_tool(tool_classes, t, state) for t in tools],
+                model=self.model,
+                problem_statement=prompt,
+                # Budgets keep per-run state, so each agent gets its own
+                context_budget=create_context_budget(self.context, self.context_policy),
+                num_candidates=self.num_candidates,
+                interpreter_pool=self.pool,
+            ):
+                if isinstance(o, ActionStep):
+                    generate_explain_action_step(explanation, o)
+                    if o.trace and o.tool_calls:
+                        for call in o.tool_calls:
+                            generate_python_tool_call(python, call)
+                    python.flush()
+                    explanation.flush()
+                elif isinstance(o, AgentText):
+                    print(o.to_string())
+
+            reformat_python(python)
+
+
+def generate_test(model, code_file, tools, prompt, output, explain, llm_api_base):
+    session = TestGenSession(model, code_file, llm_api_base)
+    session.generate(tools, prompt, output, explain)
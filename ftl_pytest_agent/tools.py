@@ -5,7 +5,6 @@ from smolagents._function_type_hints_utils import (
     TypeHintParsingException,
 )
 from typing import Callable, Dict
-import types
 import inspect
 import importlib
 
@@ -17,6 +16,9 @@ from ftl_pytest_agent._function_type_hints_utils import (
 import re
 import json
 
+from ftl_pytest_agent.schema_cache import cached_schema
+from ftl_pytest_agent.util import load_module
+
 
 # from smolagents._function_type_hints_utils
 # modified to ignore self parameter
@@ -53,9 +55,14 @@ def _convert_type_hints_to_json_schema(
     return schema
 
 
+def get_json_schema(func: Callable) -> tuple:
+    """Cached version of `_get_json_schema`, returning the (description, inputs, output type) of a tool function."""
+    return tuple(cached_schema("tools.get_json_schema", func, lambda: list(_get_json_schema(func))))
+
+
 # from smolagents._function_type_hints_utils
 # modified to ignore self parameter
-def get_json_schema(func: Callable) -> Dict:
+def _get_json_schema(func: Callable) -> Dict:
     """
     This function generates a JSON schema for a given function, based on its docstring and type hints. This is
     mostly used for passing lists of tools to a chat template. The JSON schema contains the name and description of
@@ -220,19 +227,17 @@ def load_tools(tools_file):
 
 def load_code(code_file):
 
-    # Load module from file path
-    spec = importlib.util.spec_from_file_location("tools", code_file)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    # Shared with the header generation, the file is only executed once
     print('module')
+    return dict(load_module(code_file).tools)
+
+
+def load_functions(fns):
 
     tool_classes = {}
 
-    # Find and instantiate the Tool class
-    for item_name in dir(module):
-        item = getattr(module, item_name)
-        if isinstance(item, types.FunctionType):
-            tool_classes[item.__name__] = tool(item)
+    for fn in fns:
+        tool_classes[fn.__name__] = tool(fn)
 
     return tool_classes
 
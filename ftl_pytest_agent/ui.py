@@ -1,61 +1,62 @@
 import click
 
-from .core import create_model, make_agent
-from .default_tools import TOOLS
-from .tools import get_tool, load_tools, load_code
-import gradio as gr
 from functools import partial
 
-from .codegen import (
-    generate_python_header,
-    reformat_python,
-    generate_explain_header,
-)
-
 from ftl_pytest_agent.util import Bunch
-from ftl_pytest_agent.Gradio_UI import stream_to_gradio
 
 
 def bot(context, prompt, messages, tools):
+    import gradio as gr
+    from .core import make_agent
+    from .tools import get_tool
+    from .codegen import (
+        TestFileWriter,
+        generate_python_header,
+        reformat_python,
+        generate_explain_header,
+    )
+    from ftl_pytest_agent.Gradio_UI import stream_to_gradio
+
     agent = make_agent(
         tools=[get_tool(context.tool_classes, t, context.state) for t in tools],
         model=context.model,
+        stream_outputs=True,
+    )
+    writers = Bunch(
+        python=TestFileWriter(context.python),
+        explain=TestFileWriter(context.explain),
     )
     generate_python_header(
-        context.python,
+        writers.python,
         prompt,
         context.tools_files,
         context.code_files,
         tools,
     )
-    generate_explain_header(context.explain, prompt)
-
-    def update_code():
-        nonlocal python_output
-        with open(context.python) as f:
-            python_output = f.read()
-
-    python_output = ""
-
-    update_code()
+    generate_explain_header(writers.explain, prompt)
 
     # chat interface only needs the latest messages yielded
     messages = []
     messages.append(gr.ChatMessage(role="user", content=prompt))
-    yield messages, python_output
+    yield messages, writers.python.text
     for msg in stream_to_gradio(
-        agent, context, task=prompt, reset_agent_memory=False
+        agent, writers, task=prompt, reset_agent_memory=False
     ):
-        update_code()
-        messages.append(msg)
-        yield messages, python_output
+        # The pending message is the model output being generated, replaced as it grows
+        if messages[-1].metadata.get("status") == "pending":
+            messages[-1] = msg
+        else:
+            messages.append(msg)
+        yield messages, writers.python.text
 
-    reformat_python(context.python)
-    update_code()
-    yield messages, python_output
+    reformat_python(writers.python)
+    writers.explain.close()
+    yield messages, writers.python.text
 
 
 def launch(context, tool_classes, **kwargs):
+    import gradio as gr
+
     with gr.Blocks(fill_height=True) as demo:
         python_code = gr.Code(render=False)
         with gr.Row():
@@ -100,6 +101,11 @@ def main(
     explain,
 ):
     """A agent that solves a problem given a system design and a set of tools"""
+    # Imported here so --help does not load gradio, smolagents and litellm
+    from .core import create_model
+    from .default_tools import TOOLS
+    from .tools import load_tools, load_code
+
     tool_classes = {}
     tool_classes.update(TOOLS)
     for tf in tools_files:
@@ -1,5 +1,7 @@
+import ast
 import importlib
 import os
+import threading
 import types
 
 
@@ -8,22 +10,107 @@ class Bunch:
         self.__dict__.update(kwargs)
 
 
-def get_functions(code_file):
+class ModuleInfo:
+    """A code file executed once: the module, its functions and the tools made from them."""
+
+    def __init__(self, module, fns):
+        self.module = module
+        self.fns = fns
+        self._tools = None
+        self._lock = threading.Lock()
+
+    @property
+    def tools(self):
+        # Building the tools parses every docstring, so it is only done when a caller needs them
+        with self._lock:
+            if self._tools is None:
+                from .tools import load_functions
+
+                self._tools = load_functions(self.fns)
+        return self._tools
+
+
+# ModuleInfo of each code file by absolute path, with the mtime it was loaded at
+_modules = {}
+_modules_lock = threading.Lock()
 
-    # Load module from file path
+
+def load_module(code_file):
+    """Returns the ModuleInfo of a code file, executing it again only if the file changed."""
     if not code_file.endswith(".py"):
         raise Exception("Expects a python file")
-    module_name = os.path.basename(code_file[:-3])
-    spec = importlib.util.spec_from_file_location(module_name, code_file)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    path = os.path.abspath(code_file)
+    mtime = os.stat(path).st_mtime_ns
+    with _modules_lock:
+        cached = _modules.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        # Load module from file path
+        module_name = os.path.basename(code_file[:-3])
+        spec = importlib.util.spec_from_file_location(module_name, code_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        fns = []
 
-    fns = []
+        # Find the functions to test
+        for item_name in dir(module):
+            item = getattr(module, item_name)
+            if isinstance(item, types.FunctionType):
+                fns.append(item)
 
-    # Find and instantiate the Tool class
-    for item_name in dir(module):
-        item = getattr(module, item_name)
-        if isinstance(item, types.FunctionType):
-            fns.append(item)
+        info = ModuleInfo(module, fns)
+        _modules[path] = (mtime, info)
+        return info
 
+
+def get_functions(code_file):
+    info = load_module(code_file)
+    return info.module, info.fns
+
+
+class StaticFunction:
+    """
+    A function found by parsing the source, without importing it.
+
+    It has the `__name__` and `__doc__` of the function so it can be used in place of the function object when
+    building prompts and test headers.
+    """
+
+    def __init__(self, node):
+        self.__name__ = node.name
+        self.__doc__ = ast.get_docstring(node, clean=False)
+        self.lineno = node.lineno
+        self.signature = f"({ast.unparse(node.args)})"
+        self.type_hints = {
+            arg.arg: ast.unparse(arg.annotation)
+            for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+            if arg.annotation is not None
+        }
+        if node.returns is not None:
+            self.signature += f" -> {ast.unparse(node.returns)}"
+            self.type_hints["return"] = ast.unparse(node.returns)
+
+    def __repr__(self):
+        return f"<function {self.__name__}{self.signature}>"
+
+
+def get_functions_static(code_file):
+    """
+    Like get_functions but reads the functions from the source with ast, nothing in the file is executed.
+
+    Only the functions defined at the top level of the file are found, not the ones it imports.
+    """
+    if not code_file.endswith(".py"):
+        raise Exception("Expects a python file")
+    with open(code_file) as f:
+        tree = ast.parse(f.read(), filename=code_file)
+    module = types.SimpleNamespace(__name__=os.path.basename(code_file[:-3]), __file__=code_file)
+    fns = [
+        StaticFunction(node)
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
+    fns.sort(key=lambda fn: fn.__name__)
     return module, fns
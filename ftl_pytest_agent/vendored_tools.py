@@ -44,6 +44,7 @@ from ftl_pytest_agent._function_type_hints_utils import (
     get_imports,
     get_json_schema,
 )
+from ftl_pytest_agent.schema_cache import cached_schema
 from smolagents.agent_types import handle_agent_input_types, handle_agent_output_types
 from smolagents.tool_validation import MethodChecker, validate_tool_attributes
 from smolagents.utils import _is_package_available, _is_pillow_available, get_source, instance_to_source
@@ -154,9 +155,11 @@ class Tool:
                     "Tool's 'forward' method should take 'self' as its first argument, then its next arguments should match the keys of tool attribute 'inputs'."
                 )
 
-            json_schema = _convert_type_hints_to_json_schema(self.forward, error_on_missing_type_hints=False)[
-                "properties"
-            ]  # This function will not raise an error on missing docstrings, contrary to get_json_schema
+            json_schema = cached_schema(
+                "convert_type_hints_to_json_schema",
+                self.forward,
+                lambda: _convert_type_hints_to_json_schema(self.forward, error_on_missing_type_hints=False),
+            )["properties"]  # This function will not raise an error on missing docstrings, contrary to get_json_schema
             for key, value in self.inputs.items():
                 assert key in json_schema, (
                     f"Input '{key}' should be present in function signature, found only {json_schema.keys()}"
@@ -883,7 +886,9 @@ def tool(tool_function: Callable) -> Tool:
         tool_function: Your function. Should have type hints for each input and a type hint for the output.
         Should also have a docstring description including an 'Args:' part where each argument is described.
     """
-    tool_json_schema = get_json_schema(tool_function)["function"]
+    tool_json_schema = cached_schema("get_json_schema", tool_function, lambda: get_json_schema(tool_function))[
+        "function"
+    ]
     if "return" not in tool_json_schema:
         raise TypeHintParsingException("Tool return type not found: make sure your function has a return type hint!")
 
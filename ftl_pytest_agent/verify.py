@@ -0,0 +1,139 @@
+"""
+Verification of generated tests with pytest running in this process.
+
+All the generated test files are run in one pytest session, so collection and the import of the module under test
+are paid once, and a plugin collects the outcome and the duration of every file. With `workers` the tests are
+distributed with pytest-xdist when it is installed.
+"""
+
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FileResult:
+    """Outcome of the tests of one file."""
+
+    path: str
+    passed: int = 0
+    failed: int = 0
+    errors: int = 0
+    duration: float = 0.0
+    failures: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.passed > 0 and self.failed == 0 and self.errors == 0
+
+    @property
+    def status(self) -> str:
+        if self.ok:
+            return "passed"
+        if self.errors:
+            return "error"
+        if self.failed:
+            return "failed"
+        return "no tests"
+
+
+class ResultCollector:
+    """pytest plugin recording a `FileResult` per test file."""
+
+    def __init__(self, paths: Iterable[str]):
+        self.results = {os.path.abspath(path): FileResult(path) for path in paths}
+
+    def _result(self, nodeid: str) -> Optional[FileResult]:
+        path = os.path.abspath(nodeid.split("::", 1)[0])
+        return self.results.get(path)
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            result = self._result(report.nodeid)
+            if result is not None:
+                result.errors += 1
+                result.failures.append(str(report.longrepr))
+
+    def pytest_runtest_logreport(self, report):
+        result = self._result(report.nodeid)
+        if result is None:
+            return
+        result.duration += report.duration
+        if report.when == "call":
+            if report.passed:
+                result.passed += 1
+            elif report.failed:
+                result.failed += 1
+                result.failures.append(str(report.longrepr))
+        elif report.failed:
+            # Failures in setup or teardown
+            result.errors += 1
+            result.failures.append(str(report.longrepr))
+
+
+def _xdist_available() -> bool:
+    try:
+        import xdist  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def verify_tests(
+    paths: Iterable[str], import_paths: Iterable[str] = (), workers: Optional[int] = None
+) -> Dict[str, FileResult]:
+    """
+    Runs the test files in `paths` in one pytest session and returns their results by path.
+
+    `import_paths` are put on sys.path for the session, so the tests can import the code under test. Test modules
+    left in sys.modules by a previous verification are dropped first, so a regenerated file is imported again. A path
+    that does not exist is reported as an error without running pytest on it.
+    """
+    import pytest
+
+    paths = list(paths)
+    collector = ResultCollector(paths)
+    # pytest runs nothing when one of its arguments does not exist, as for a job whose generation failed
+    missing = [path for path in paths if not os.path.exists(path)]
+    for path in missing:
+        result = collector.results[os.path.abspath(path)]
+        result.errors += 1
+        result.failures.append(f"{path} does not exist")
+    paths = [path for path in paths if path not in missing]
+    if not paths:
+        return {result.path: result for result in collector.results.values()}
+    # A generated file that does not import must not stop the others from running
+    args = ["-q", "-p", "no:cacheprovider", "--continue-on-collection-errors", "--rootdir", os.getcwd(), *paths]
+    if workers and workers > 1:
+        if _xdist_available():
+            args += ["-n", str(workers)]
+        else:
+            logger.warning("pytest-xdist is not installed, running the tests in one process")
+
+    for path in paths:
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        sys.modules.pop(module_name, None)
+    added = [os.path.abspath(path) for path in import_paths if os.path.abspath(path) not in sys.path]
+    sys.path[:0] = added
+    start = time.time()
+    try:
+        pytest.main(args, plugins=[collector])
+    finally:
+        for path in added:
+            sys.path.remove(path)
+    logger.debug(f"Verified {len(paths)} files in {time.time() - start:.1f}s")
+    return {result.path: result for result in collector.results.values()}
+
+
+def verify_tests_in_fork(context, paths, import_paths, workers):
+    """`verify_tests` for `ForkServer.call`, so the tests run against a copy of the warm template."""
+    return verify_tests(paths, import_paths=import_paths, workers=workers)
+
+
+__all__ = ["FileResult", "ResultCollector", "verify_tests", "verify_tests_in_fork"]
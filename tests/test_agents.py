@@ -0,0 +1,59 @@
+import pytest
+
+from smolagents.models import ChatMessage
+
+from ftl_pytest_agent.agents import ModelStreamDelta
+from ftl_pytest_agent.core import make_agent
+from ftl_pytest_agent.default_tools import Complete
+from ftl_pytest_agent.models import StopSequenceDetector
+
+
+COMPLETION = (
+    "<think>\nA first draft:\n```py\ndraft = True\n```\n</think>\n"
+    "Thought: call it\nCode:\n```py\nresult = 40 + 2\ncomplete(str(result))\n```<end_code>\n"
+    "Observation: the model kept writing"
+)
+
+
+class StreamingModel:
+    model_id = "fake"
+    last_input_token_count = 0
+    last_output_token_count = 0
+
+    def __init__(self):
+        self.read = 0
+
+    def __call__(self, messages, stop_sequences=None, **kwargs):
+        return ChatMessage(role="assistant", content=COMPLETION.split("<end_code>")[0])
+
+    def stream(self, messages, stop_sequences=None, **kwargs):
+        for index in range(0, len(COMPLETION), 4):
+            self.read = index + 4
+            yield COMPLETION[index:index + 4]
+
+
+def test_stop_sequence_detector_finds_sequences_split_between_deltas():
+    detector = StopSequenceDetector(["<end_code>", "Observation:"])
+    assert not detector.feed("```py\nx = 1\n```<end")
+    assert detector.feed("_code>\nmore")
+    assert detector.text == "```py\nx = 1\n```"
+
+
+def test_streamed_step_runs_the_same_code_as_the_whole_completion():
+    outputs = {}
+    for stream_outputs in (False, True):
+        model = StreamingModel()
+        agent = make_agent([Complete({})], model, stream_outputs=stream_outputs)
+        steps = list(agent.run("task", stream=True))
+        outputs[stream_outputs] = (steps[-1], agent.python_executor.state.get("draft"))
+        if stream_outputs:
+            assert any(isinstance(step, ModelStreamDelta) for step in steps)
+            # The stream is closed at <end_code>
+            assert model.read < len(COMPLETION)
+    assert outputs[True] == outputs[False] == ("42", True)
+
+
+def test_arun_rejects_stream_outputs():
+    agent = make_agent([Complete({})], StreamingModel(), stream_outputs=True)
+    with pytest.raises(ValueError, match="stream_outputs"):
+        agent.arun("task")
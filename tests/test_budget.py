@@ -0,0 +1,37 @@
+import pytest
+
+from ftl_pytest_agent.budget import POLICIES, ContextBudget
+from ftl_pytest_agent.memory import ActionStep, AgentMemory, TaskStep, ToolCall
+
+
+def memory_with_observations(*observations):
+    memory = AgentMemory("You write tests.")
+    memory.steps.append(TaskStep(task="Test add"))
+    for number, observation in enumerate(observations, 1):
+        memory.steps.append(
+            ActionStep(
+                step_number=number,
+                model_output=f"Thought: step {number}\nCode:\n```py\nprint(add(1, 2))\n```",
+                tool_calls=[ToolCall(name="python_interpreter", arguments="print(add(1, 2))", id=f"call_{number}")],
+                observations=observation,
+            )
+        )
+    return memory
+
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("max_tokens", [200, 500, 2000])
+def test_fit_stays_within_max_tokens(policy, max_tokens):
+    budget = ContextBudget(max_tokens, policy=policy)
+    for memory in (memory_with_observations("x" * 100000), memory_with_observations("a" * 3000, "b" * 50000, "c")):
+        messages = budget.fit(memory)
+        assert budget.count(messages) <= max_tokens
+        assert budget.last_total == budget.count(messages)
+
+
+def test_fit_keeps_the_start_of_a_truncated_observation():
+    budget = ContextBudget(500, policy="summarize")
+    messages = budget.fit(memory_with_observations("start " + "x" * 100000))
+    observation = messages[-1]["content"]
+    assert observation[0]["text"].startswith("Call id: call_1\nObservation:\nstart x")
+    assert "truncated" in observation[-1]["text"]
@@ -0,0 +1,19 @@
+import importlib.util
+import os
+
+import pytest
+
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks", "import_time.py")
+
+spec = importlib.util.spec_from_file_location("import_time", SCRIPT)
+import_time = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(import_time)
+
+
+@pytest.mark.parametrize("module", import_time.MODULES)
+def test_entry_point_import_time(module):
+    # Best of three, a single run is easily slowed down by the rest of the machine
+    runs = [import_time.import_times(module) for _ in range(3)]
+    times = min(runs, key=lambda times: times[module][1])
+    assert import_time.check(module, times) == []
@@ -0,0 +1,116 @@
+import ast
+
+import pytest
+
+from ftl_pytest_agent.local_python_executor import (
+    InterpreterError,
+    LocalPythonInterpreter,
+    PrintContainer,
+    _operations,
+    evaluate_ast,
+    evaluate_python_code,
+)
+
+
+def truncated(text, max_length):
+    tail_size = max_length - max_length // 2
+    return (
+        text[:max_length // 2]
+        + f"\n..._This content has been truncated to stay below {max_length} characters_...\n"
+        + (text[-tail_size:] if tail_size else "")
+    )
+
+
+@pytest.mark.parametrize("max_length", [0, 1, 2, 3, 10])
+def test_print_container_small_max_length(max_length):
+    output = PrintContainer(max_length)
+    chunks = ["a", "bc", "", "defg", "h\n", "ijklmnop"]
+    for chunk in chunks:
+        output.append(chunk)
+    text = "".join(chunks)
+    assert str(output) == truncated(text, max_length)
+
+
+def test_print_container_under_max_length():
+    output = PrintContainer(5)
+    output += "ab"
+    output += "cde"
+    assert str(output) == "abcde"
+    assert len(output) == 5
+
+
+def test_print_container_rejects_negative_max_length():
+    with pytest.raises(ValueError):
+        PrintContainer(-1)
+
+
+def test_delete_global_in_function_is_interpreter_error():
+    code = "x = 1\ndef f():\n    del x\nf()"
+    with pytest.raises(InterpreterError, match="Cannot delete name 'x': name is not defined"):
+        evaluate_python_code(code, state={})
+
+
+def test_fork_runs_functions_defined_earlier_on_its_state():
+    interpreter = LocalPythonInterpreter([], {})
+    interpreter("x = 1\ndef f():\n    return x", {})
+
+    forked = interpreter.fork()
+    assert forked("x = 2\nf()", {})[0] == 2
+    # Not committed yet
+    assert interpreter("f()", {})[0] == 1
+
+    interpreter.commit(forked)
+    assert interpreter("f()", {})[0] == 2
+    assert interpreter("x = 3\nf()", {})[0] == 3
+
+
+def test_discarded_fork_leaves_state_unchanged():
+    interpreter = LocalPythonInterpreter([], {})
+    interpreter("items = [1]\ndef size():\n    return len(items)", {})
+
+    forked = interpreter.fork()
+    assert forked("items.append(2)\nsize()", {})[0] == 2
+    assert forked("items.append(3)\nsize()", {})[0] == 3
+    assert interpreter("size()", {})[0] == 1
+    assert interpreter.state["items"] == [1]
+
+
+def test_imported_modules_are_read_only():
+    interpreter = LocalPythonInterpreter(["math"], {})
+    with pytest.raises(InterpreterError, match="Cannot set attribute 'pi' of module 'math'"):
+        interpreter("import math\nmath.pi = 3", {})
+    assert LocalPythonInterpreter(["math"], {})("import math\nmath.pi", {})[0] == pytest.approx(3.14159, abs=1e-5)
+
+
+def test_fork_keeps_the_objects_of_the_interpreter():
+    interpreter = LocalPythonInterpreter([], {})
+    outside = [1]
+    interpreter.state["shared"] = outside
+    interpreter("other = [2]\ndef grow():\n    other.append(3)", {})
+
+    forked = interpreter.fork()
+    forked("grow()\nshared.append(2)", {})
+    assert outside == [1]
+    assert interpreter.state["other"] == [2]
+
+    interpreter.commit(interpreter.fork())
+    assert interpreter.state["shared"] is outside
+
+
+def test_commit_applies_functions_and_deletions_of_the_fork():
+    interpreter = LocalPythonInterpreter([], {})
+    interpreter("x = 1\ny = 1", {})
+
+    forked = interpreter.fork()
+    forked("def g():\n    return x\ndel y", {})
+    assert "y" in interpreter.state
+    interpreter.commit(forked)
+
+    assert "y" not in interpreter.state
+    assert interpreter("x = 5\ng()", {})[0] == 5
+
+
+def test_direct_evaluate_ast_calls_are_counted_separately():
+    node = ast.parse("1 + 1").body[0]
+    assert [evaluate_ast(node, {}, {}, {}) for _ in range(3)] == [2, 2, 2]
+    assert _operations.get() is None
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from ftl_pytest_agent.models import CachingModel
+from ftl_pytest_agent.response_cache import ResponseCache, request_key
+
+
+# The key of the first request of an agent, its system prompt lists the authorized imports
+KEY_SCRIPT = """
+from ftl_pytest_agent.core import make_agent
+from ftl_pytest_agent.response_cache import request_key
+
+
+class Model:
+    model_id = "fake"
+
+
+agent = make_agent([], Model())
+messages = [{"role": "system", "content": agent.initialize_system_prompt()}]
+print(request_key("fake", messages, ["<end_code>"], extra={"b", "a", "c"}))
+"""
+
+
+def key_with_hash_seed(seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    result = subprocess.run([sys.executable, "-c", KEY_SCRIPT], env=env, capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_request_key_is_the_same_across_processes():
+    assert key_with_hash_seed(1) == key_with_hash_seed(2)
+
+
+def test_request_key_depends_on_the_messages():
+    messages = [{"role": "user", "content": "a"}]
+    assert request_key("m", messages) == request_key("m", list(messages))
+    assert request_key("m", messages) != request_key("m", [{"role": "user", "content": "b"}])
+    assert request_key("m", messages) != request_key("m", messages, ["stop"])
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size=10)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    assert cache.get("a") is not None
+    cache.put("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+class StreamingModel:
+    model_id = "fake"
+    last_input_token_count = 0
+    last_output_token_count = 0
+
+    def __init__(self, chunks, api_base="http://a"):
+        self.chunks = chunks
+        self.api_base = api_base
+
+    def to_dict(self):
+        return {"model_id": self.model_id, "api_base": self.api_base, "api_key": "secret", "last_input_token_count": 3}
+
+    def stream(self, messages, stop_sequences=None, **kwargs):
+        yield from self.chunks
+
+
+MESSAGES = [{"role": "user", "content": "task"}]
+
+
+def test_caching_model_keys_on_the_model_settings():
+    cache = ResponseCache(":memory:")
+    model = CachingModel(StreamingModel([]), cache)
+    assert "api_key" not in model.settings
+    assert "last_input_token_count" not in model.settings
+    other = CachingModel(StreamingModel([], api_base="http://b"), cache)
+    assert model._key(MESSAGES) != other._key(MESSAGES)
+    assert model._key(MESSAGES) == CachingModel(StreamingModel([]), cache)._key(MESSAGES)
+
+
+def test_caching_model_stores_a_stream_read_to_the_end_or_a_stop_sequence():
+    cache = ResponseCache(":memory:")
+    model = CachingModel(StreamingModel(["Code: x", " = 1<end", "_code>Observation: more"]), cache)
+    assert "".join(model.stream(MESSAGES, stop_sequences=["<end_code>"])) == "Code: x = 1"
+    assert list(model.stream(MESSAGES, stop_sequences=["<end_code>"])) == ["Code: x = 1"]
+    assert (model.hits, model.misses) == (1, 1)
+
+
+def test_caching_model_does_not_store_a_stream_closed_early():
+    cache = ResponseCache(":memory:")
+    model = CachingModel(StreamingModel(["a", "b", "c"]), cache)
+    with pytest.raises(RuntimeError):
+        for chunk in model.stream(MESSAGES):
+            if chunk == "b":
+                raise RuntimeError("consumer failed")
+    assert len(cache) == 0
+    assert "".join(model.stream(MESSAGES)) == "abc"
+    assert len(cache) == 1
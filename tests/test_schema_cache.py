@@ -0,0 +1,25 @@
+import importlib
+import sys
+
+from ftl_pytest_agent.schema_cache import schema_key
+
+
+def test_schema_key_changes_with_an_imported_type_hint(tmp_path, monkeypatch):
+    (tmp_path / "schema_hint_types.py").write_text("import enum\n\nclass Color(enum.Enum):\n    RED = 'red'\n")
+    (tmp_path / "schema_hint_tool.py").write_text(
+        "from schema_hint_types import Color\n\n"
+        "def paint(color: Color) -> str:\n"
+        '    """Paints.\n\n    Args:\n        color: The color\n    """\n'
+        "    return color.value\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ("schema_hint_types", "schema_hint_tool"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    paint = importlib.import_module("schema_hint_tool").paint
+
+    key = schema_key("test", paint)
+    assert schema_key("test", paint) == key
+    (tmp_path / "schema_hint_types.py").write_text(
+        "import enum\n\nclass Color(enum.Enum):\n    RED = 'red'\n    BLUE = 'blue'\n"
+    )
+    assert schema_key("test", paint) != key
@@ -0,0 +1,17 @@
+from ftl_pytest_agent.verify import verify_tests
+
+
+def test_missing_files_do_not_stop_the_others(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test_generated_ok.py").write_text("def test_ok():\n    assert True\n")
+
+    results = verify_tests(["test_generated_ok.py", "test_generated_missing.py"])
+
+    assert results["test_generated_ok.py"].status == "passed"
+    assert results["test_generated_missing.py"].status == "error"
+    assert results["test_generated_missing.py"].failures == ["test_generated_missing.py does not exist"]
+
+
+def test_only_missing_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert verify_tests(["test_generated_missing.py"])["test_generated_missing.py"].status == "error"